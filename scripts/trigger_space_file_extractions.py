@@ -144,11 +144,13 @@ def submit_file_extraction_with_status(
     client: ClowderClient,
     file_id: str,
     extractor_name_or_id: str,
+    force: bool = False,
 ) -> None:
-    response = client.post(
-        f"/files/{file_id}/extractions",
-        {"extractor": extractor_name_or_id},
-    )
+    payload: dict[str, Any] = {"extractor": extractor_name_or_id}
+    if force:
+        # Extract again even if the input is unchanged since the last extraction
+        payload["parameters"] = {"force": True}
+    response = client.post(f"/files/{file_id}/extractions", payload)
     LOGGER.debug("Extraction submit response for file %s: %s", file_id, response)
 
 
@@ -161,6 +163,7 @@ def process_space(
     ssl_verify: bool = True,
     dry_run: bool = False,
     limit: int | None = None,
+    force: bool = False,
 ) -> dict:
     _sdk_host, client_host = normalize_host(host)
     client = ClowderClient(host=client_host, key=api_key, ssl=ssl_verify)
@@ -224,6 +227,7 @@ def process_space(
                     client=client,
                     file_id=file_id,
                     extractor_name_or_id=extractor_name_or_id,
+                    force=force,
                 )
                 totals["extractions_submitted"] += 1
             except Exception as exc:
@@ -283,6 +287,11 @@ def build_parser() -> argparse.ArgumentParser:
         action="store_true",
         help="Disable SSL certificate verification.",
     )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Extract files again even if they are unchanged since their last extraction.",
+    )
     parser.add_argument(
         "--dry-run",
         action="store_true",
@@ -314,6 +323,7 @@ def main() -> int:
         ssl_verify=not args.insecure,
         dry_run=args.dry_run,
         limit=args.limit,
+        force=args.force,
     )
 
     LOGGER.info("Completed run summary:\n%s", json.dumps(totals, indent=2))
@@ -4,14 +4,24 @@ import logging
 import os
 import csv
 import tempfile
+from contextlib import ExitStack
 import typing
 
-import requests
 from pyclowder.extractors import Extractor
 from pyclowder.utils import CheckMessage
 import pyclowder.files
-import pandas as pd
-import matplotlib.pyplot as plt
+
+from clowder_extractors.parameter_extractor.clowder_http import clowder_request
+from clowder_extractors.parameter_extractor.curve import (
+    CurveArrays,
+    curve_sidecar_name,
+    write_curve_sidecar,
+)
+from clowder_extractors.parameter_extractor.plotting import (
+    plot_heat_flow,
+    rendering,
+)
+from clowder_extractors.warmup import import_modules, render_plot, warm_up
 
 # Below comments are examples of how to import functions from other extractors
 # from clowder_extractors.parameter_extractor.remat_parameter_extractor import make_plot
@@ -39,28 +49,35 @@ def is_float(element: any) -> bool:
 def set_dataset_title(connector, host, key, dataset_id, datasetname, description):
     logging.getLogger(__name__)
     url = "%sapi/datasets/%s/title?key=%s" % (host, dataset_id, key)
-    result = requests.put(
+    result = clowder_request(
+        connector,
+        "PUT",
         url,
         headers={"Content-Type": "application/json"},
         data=json.dumps({"name": datasetname}),
-        verify=connector.ssl_verify if connector else True,
     )
     result.raise_for_status()
 
     url = "%sapi/datasets/%s/description?key=%s" % (host, dataset_id, key)
-    result = requests.put(
+    result = clowder_request(
+        connector,
+        "PUT",
         url,
         headers={"Content-Type": "application/json"},
         data=json.dumps({"description": description}),
-        verify=connector.ssl_verify if connector else True,
     )
     result.raise_for_status()
 
 
-def extract_parameters(path, stripped_file: typing.TextIO):
+def extract_parameters(
+    path, stripped_file: typing.TextIO, curve: typing.Optional[CurveArrays] = None
+):
     params = {}
     stripped_csv = csv.writer(stripped_file)
-    stripped_csv.writerow(["Time", "Temperature", "Heat Flow (Normalized)"])
+    header = ["Time", "Temperature", "Heat Flow (Normalized)"]
+    stripped_csv.writerow(header)
+    if curve is not None:
+        curve.set_columns(header)
 
     with open(path, "r") as experiment_file:
         reader = csv.reader(experiment_file)
@@ -74,34 +91,20 @@ def extract_parameters(path, stripped_file: typing.TextIO):
             # Valid rows contain all numbers. Others are headers or comments
             if not any([not is_float(val) for val in row2]) and row2:
                 stripped_csv.writerow(row2)
+                if curve is not None:
+                    curve.append(row2)
     return params
 
 
-def make_plot(dsc_file_path, tmpdirname):
-
-    # Plotting Heat Flow vs. Temperature graph
-    df = pd.read_csv(dsc_file_path)
-    df.columns = ["Temperature", "Heat Flow (Normalized)", "Heat Flow"]
-    temperature = df["Temperature"]
-    heat_flow = df["Heat Flow"]
-
-    # Plot graph
-    plt.plot(temperature, heat_flow)
+def make_plot(curve: CurveArrays, tmpdirname):
 
-    # Add axis labels and title
-    plt.xlabel("Temperature")
-    plt.ylabel("Heat Flow")
-    plt.title("Heat Flow vs. Temperature")
+    # Plotting Heat Flow vs. Temperature graph. Plots the first and third
+    # values of each stripped row, as before; the header written to
+    # DSC_Curve.csv names those columns Time and Heat Flow (Normalized)
+    temperature = curve.column(0)
+    heat_flow = curve.column(2)
 
-    # Save output image files
-    plt.tight_layout()
-    graph_file_path = os.path.join(tmpdirname, "DSC_Curve.png")
-    plt.savefig(graph_file_path, format="png", dpi=300)
-    thumb_file_path = os.path.join(tmpdirname, "DSC_Curve_thumb.png")
-    plt.savefig(thumb_file_path, format="png", dpi=80)
-
-    plt.close()
-    return graph_file_path, thumb_file_path
+    return plot_heat_flow(temperature, heat_flow, tmpdirname)
 
 
 class CSVStripper(Extractor):
@@ -118,7 +121,7 @@ class CSVStripper(Extractor):
     def check_message(self, connector, host, secret_key, resource, parameters):
         # Don't operate on the output of this extractor. Only the raw input files from
         # the instrument
-        if resource["name"] == "DSC_Curve.csv":
+        if resource["name"] in ("DSC_Curve.csv", curve_sidecar_name()):
             return CheckMessage.ignore
         else:
             return CheckMessage.download
@@ -126,14 +129,20 @@ class CSVStripper(Extractor):
     def process_message(self, connector, host, secret_key, resource, parameters):
         logger = logging.getLogger("__main__")
 
-        with tempfile.TemporaryDirectory() as tmpdirname:
+        # The render is waited for before the temporary directory is removed
+        with tempfile.TemporaryDirectory() as tmpdirname, ExitStack() as renders:
             dsc_file_path = os.path.join(tmpdirname, "DSC_Curve.csv")
+            curve = CurveArrays()
             with open(dsc_file_path, "w") as dsc_file:
-                dsc_file = open(os.path.join(tmpdirname, "DSC_Curve.csv"), "w")
-                parameters = extract_parameters(resource["local_paths"][0], dsc_file)
+                parameters = extract_parameters(
+                    resource["local_paths"][0], dsc_file, curve
+                )
 
             logger.debug(parameters)
 
+            # Render the plot while the CSV uploads
+            plot = renders.enter_context(rendering(make_plot, curve, tmpdirname))
+
             # Upload the stripped CSV file
             uploaded_id = pyclowder.files.upload_to_dataset(
                 connector,
@@ -143,8 +152,19 @@ class CSVStripper(Extractor):
                 dsc_file_path,
             )
 
-            # Make a plot and thumbnail of the plot
-            graph_file_path, thumb_file_path = make_plot(dsc_file_path, tmpdirname)
+            # Upload a compact binary copy of the curve alongside the CSV
+            sidecar_file_path = write_curve_sidecar(curve, tmpdirname)
+            if sidecar_file_path:
+                pyclowder.files.upload_to_dataset(
+                    connector,
+                    host,
+                    secret_key,
+                    resource["parent"].get("id", None),
+                    sidecar_file_path,
+                )
+
+            # Wait for the plot and thumbnail of the plot
+            graph_file_path, thumb_file_path = plot.result()
 
             # Attach to our uploaded CSV file
             pyclowder.files.upload_preview(
@@ -190,6 +210,7 @@ class CSVStripper(Extractor):
 
 def main():
     extractor = CSVStripper()
+    warm_up([import_modules("numpy", "matplotlib", "PIL"), render_plot()])
     extractor.start()
 
 
@@ -0,0 +1,157 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Optional, Tuple
+
+import pandas
+import requests
+
+# Published chemistry database. Everyone with the link has read access.
+CHEMDB_URL = "https://uofi.box.com/shared/static/p8r6ef1lcj0lk44ggcb6zmv1d66abyfk.csv"
+
+logger = logging.getLogger(__name__)
+
+
+class ChemDBSnapshot:
+    """
+    Local on-disk copy of the chemistry database CSV.
+
+    The parsed table is saved as JSON together with the ETag / Last-Modified
+    headers of the download. JSON rather than pickle, so a file planted in a
+    shared cache directory can't run code in the extractor. Within the TTL the snapshot is used as-is. After that a
+    conditional GET revalidates it, and if Box cannot be reached the last good
+    snapshot is served instead.
+
+    Configured through environment variables:
+    - CHEMDB_CACHE_DIR: directory holding the snapshot (default: system temp dir)
+    - CHEMDB_CACHE_TTL: seconds before the snapshot is revalidated (default: 3600)
+    - CHEMDB_HTTP_TIMEOUT: seconds to wait for Box (default: 30)
+    """
+
+    def __init__(
+        self,
+        url: str = CHEMDB_URL,
+        cache_dir: Optional[str] = None,
+        ttl: Optional[float] = None,
+        timeout: Optional[float] = None,
+    ):
+        self.url = url
+        self.cache_dir = cache_dir or os.getenv(
+            "CHEMDB_CACHE_DIR", os.path.join(tempfile.gettempdir(), "remat-chemdb")
+        )
+        self.ttl = float(
+            ttl if ttl is not None else os.getenv("CHEMDB_CACHE_TTL", 3600)
+        )
+        self.timeout = float(
+            timeout if timeout is not None else os.getenv("CHEMDB_HTTP_TIMEOUT", 30)
+        )
+
+        url_key = hashlib.sha1(url.encode("utf-8")).hexdigest()[:12]
+        self.path = os.path.join(self.cache_dir, f"chemdb-{url_key}.json")
+
+        # Headers and checksum of the snapshot that was last loaded
+        self.info = {}
+
+    def load(self) -> pandas.DataFrame:
+        """
+        Return the chemistry table, contacting Box only when the snapshot is
+        missing or older than the TTL.
+        """
+        info, data = self._read()
+        if data is not None and self._age() < self.ttl:
+            self.info = info
+            return data
+
+        try:
+            downloaded = self._download(info if data is not None else {})
+        except requests.RequestException as e:
+            if data is None:
+                raise
+            logger.warning(
+                "Could not revalidate chemistry database (%s); using snapshot fetched at %s",
+                e,
+                time.ctime(info.get("fetched_at", 0)),
+            )
+            self.info = info
+            return data
+
+        if downloaded is None:
+            # 304 Not Modified - restart the TTL on the snapshot we already have
+            logger.debug("Chemistry database snapshot %s is current", self.path)
+            os.utime(self.path)
+            self.info = info
+            return data
+
+        info, data = downloaded
+        try:
+            self._write(info, data)
+        except OSError as e:
+            logger.warning("Could not save chemistry snapshot %s: %s", self.path, e)
+        self.info = info
+        return data
+
+    def _download(self, info: dict) -> Optional[Tuple[dict, pandas.DataFrame]]:
+        headers = {}
+        if info.get("etag"):
+            headers["If-None-Match"] = info["etag"]
+        if info.get("last_modified"):
+            headers["If-Modified-Since"] = info["last_modified"]
+
+        response = requests.get(self.url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+
+        data = pandas.read_csv(io.BytesIO(response.content))
+        info = {
+            "url": self.url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "sha256": hashlib.sha256(response.content).hexdigest(),
+            "fetched_at": time.time(),
+        }
+        logger.info("Downloaded chemistry database (sha256 %s)", info["sha256"])
+        return info, data
+
+    def _age(self) -> float:
+        return time.time() - os.path.getmtime(self.path)
+
+    def _read(self) -> Tuple[dict, Optional[pandas.DataFrame]]:
+        try:
+            with open(self.path) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            data = pandas.DataFrame(
+                snapshot["data"]["data"], columns=snapshot["data"]["columns"]
+            )
+            return snapshot["info"], data
+        except FileNotFoundError:
+            return {}, None
+        except Exception as e:
+            # A partial file from a crashed writer, or one that isn't a
+            # snapshot. Ignore it and download again.
+            logger.warning(
+                "Ignoring unreadable chemistry snapshot %s: %s", self.path, e
+            )
+            return {}, None
+
+    def _write(self, info: dict, data: pandas.DataFrame):
+        # Only this user can write to a directory the extractor creates
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+
+        # Write to a temp file and rename so concurrent readers never see a
+        # partially written snapshot
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as snapshot_file:
+                json.dump(
+                    {"info": info, "data": data.to_dict(orient="split")},
+                    snapshot_file,
+                )
+            os.replace(temp_path, self.path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
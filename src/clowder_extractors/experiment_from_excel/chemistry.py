@@ -1,20 +1,61 @@
+import logging
 import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
 from enum import Enum
+from typing import NamedTuple, Optional, Tuple
 
+import numpy as np
 import pandas
 
+from clowder_extractors.experiment_from_excel.chemdb_snapshot import ChemDBSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+class ChemRecord(NamedTuple):
+    molecular_weight: float
+    density: float
+    component: str
+    abbreviation: str
+
 
 class ChemDB:
-    def __init__(self):
+    def __init__(self, snapshot: ChemDBSnapshot = None):
         self.data = None
+        self.records = {}
+        self.abbreviations = {}
+        self.ambiguous_abbreviations = {}
+        self.snapshot = snapshot if snapshot else ChemDBSnapshot()
         self.load_database()
+        self.loaded_at = datetime.now(timezone.utc)
+
+    @property
+    def version(self) -> str:
+        # Short checksum of the CSV this table was parsed from
+        return (self.snapshot.info.get("sha256") or "unknown")[:12]
+
+    def describe(self) -> dict:
+        """
+        Identify the chemistry snapshot, for recording in extracted metadata
+        """
+        fetched_at = self.snapshot.info.get("fetched_at")
+        return {
+            "Version": self.version,
+            "Fetched at": (
+                datetime.fromtimestamp(fetched_at, timezone.utc).isoformat()
+                if fetched_at
+                else None
+            ),
+            "Loaded at": self.loaded_at.isoformat(),
+        }
 
     def load_database(self):
-        # Download the chemistry csv file
-
-        df = pandas.read_csv(
-            "https://uofi.box.com/shared/static/p8r6ef1lcj0lk44ggcb6zmv1d66abyfk.csv",
-        )
+        # Load the chemistry csv file from the local snapshot, downloading
+        # it again only when the snapshot is stale
+        df = self.snapshot.load()
 
         # Check if the index column is unique
         if df["SMILES"].is_unique:
@@ -22,37 +63,187 @@ class ChemDB:
             df.set_index("SMILES", inplace=True)
             self.data = df
 
+            # Plain dict of SMILES -> record so that lookups don't go through
+            # pandas indexing
+            self.records = {
+                smiles: ChemRecord(*values)
+                for smiles, *values in zip(
+                    df.index,
+                    df["Mwt. (g/mol)"].tolist(),
+                    df["Density (g/mL)"].tolist(),
+                    df["Component"].tolist(),
+                    df["Abbreviation"].tolist(),
+                )
+            }
+            self.index_abbreviations()
+
         else:
             print("There are duplicate entries in the chemistry database.")
             raise ValueError("There are duplicate entries in the chemistry database.")
 
+    def index_abbreviations(self):
+        """
+        Build the casefolded abbreviation -> (component, SMILES) index. When an
+        abbreviation is used by more than one entry the first one in the
+        database wins, and the clash is reported now rather than at lookup time.
+        """
+        self.abbreviations = {}
+        self.ambiguous_abbreviations = {}
+        for smiles, record in self.records.items():
+            if not isinstance(record.abbreviation, str) or not record.abbreviation:
+                continue
+            key = record.abbreviation.casefold()
+            if key not in self.abbreviations:
+                self.abbreviations[key] = (record.component, smiles)
+            else:
+                self.ambiguous_abbreviations.setdefault(
+                    key, [self.abbreviations[key][1]]
+                ).append(smiles)
+
+        for key, smiles in self.ambiguous_abbreviations.items():
+            logger.warning(
+                "Abbreviation %s is used by %d chemistry database entries (%s); using %s",
+                key,
+                len(smiles),
+                ", ".join(smiles),
+                smiles[0],
+            )
+
+    def lookup_abbreviation(self, abbreviation: str) -> Optional[Tuple[str, str]]:
+        # Returns (component, SMILES) or None if the abbreviation is unknown
+        return self.abbreviations.get(abbreviation.casefold())
+
     def exists(self, smiles: str | list) -> bool:
         if isinstance(smiles, str):
-            return smiles in self.data.index.to_list()
+            return smiles in self.records
         elif isinstance(smiles, list):
-            for test_smiles in smiles:
-                if test_smiles and not self.exists(test_smiles):
-                    raise ValueError(f"{test_smiles} not in Chemistry Database")
-                if test_smiles and (
-                    not self.molecular_weight(test_smiles)
-                    or pandas.isna(self.molecular_weight(test_smiles))
-                ):
-                    raise ValueError(
-                        f"{test_smiles} does not have a molecular weight in chemistry database"
-                    )
+            self.validate(smiles)
             return True
 
+    def validate(self, smiles: list):
+        """
+        Check every SMILES in one pass and raise a single ValueError naming all
+        of the ones that are missing or have no molecular weight
+        """
+        missing = []
+        no_weight = []
+        for test_smiles in dict.fromkeys(smiles):
+            if not test_smiles:
+                continue
+            record = self.records.get(test_smiles)
+            if record is None:
+                missing.append(test_smiles)
+            elif not record.molecular_weight or pandas.isna(record.molecular_weight):
+                no_weight.append(test_smiles)
+
+        errors = []
+        if missing:
+            errors.append(f"{', '.join(missing)} not in Chemistry Database")
+        if no_weight:
+            errors.append(
+                f"{', '.join(no_weight)} does not have a molecular weight in chemistry database"
+            )
+        if errors:
+            raise ValueError("; ".join(errors))
+
     def density(self, smiles) -> float:
-        return self.data.at[smiles, "Density (g/mL)"]
+        return self.records[smiles].density
 
     def molecular_weight(self, smiles) -> float:
-        return self.data.at[smiles, "Mwt. (g/mol)"]
+        return self.records[smiles].molecular_weight
 
     def name(self, smiles: str) -> str:
-        return self.data.at[smiles, "Component"]
+        return self.records[smiles].component
+
+
+class SharedChemDB:
+    """
+    A single ChemDB shared by every message handled in this process.
+
+    Callers should fetch the instance once per message with get() and use it
+    throughout. The refresh thread builds a complete replacement ChemDB and then
+    swaps the reference, so a message never sees a partially loaded table and
+    never waits on a reload.
+    """
+
+    def __init__(self, refresh_interval: float = None):
+        self.refresh_interval = float(
+            refresh_interval
+            if refresh_interval is not None
+            else os.getenv("CHEMDB_REFRESH_INTERVAL", 3600)
+        )
+        self._db = None
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+    def get(self) -> ChemDB:
+        db = self._db
+        if db is None:
+            with self._lock:
+                if self._db is None:
+                    self._db = ChemDB()
+                db = self._db
+        return db
+
+    @property
+    def version(self) -> Optional[str]:
+        """
+        Version of the loaded database, or None if get() hasn't loaded it yet.
+        Never loads it.
+        """
+        db = self._db
+        return db.version if db is not None else None
+
+    def refresh(self):
+        db = ChemDB()
+        current = self._db
+        if current is None or current.version != db.version:
+            logger.info(
+                "Chemistry database updated from version %s to %s",
+                current.version if current else None,
+                db.version,
+            )
+            self._db = db
+
+    def start_refresh(self):
+        """
+        Start the background thread that reloads the database every
+        refresh_interval seconds. Safe to call more than once.
+        """
+        with self._lock:
+            if self._refresh_thread is not None:
+                return
+            self._refresh_thread = threading.Thread(
+                target=self._refresh_loop, name="chemdb-refresh", daemon=True
+            )
+            self._refresh_thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(
+                    "Chemistry database refresh failed; keeping version %s: %s",
+                    self._db.version if self._db else None,
+                    e,
+                )
+
+
+shared_chemdb = SharedChemDB()
 
 
 class ChemistryConverter:
+    __slots__ = (
+        "smiles",
+        "molecular_weight",
+        "density",
+        "volume",
+        "mass",
+        "_formulation",
+    )
+
     def __init__(self, smiles: str, db: ChemDB, mass=None, volume=None):
 
         mass = None if mass == "-" else mass
@@ -67,6 +258,7 @@ class ChemistryConverter:
         if mass and volume:
             raise ValueError("Only specify one of mass or volume")
 
+        self._formulation = None
         self.smiles = smiles
         self.molecular_weight = db.molecular_weight(smiles)
         self.density = db.density(smiles)
@@ -77,6 +269,12 @@ class ChemistryConverter:
         else:
             self.mass = self.mass_from_volume(volume)
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        # Any change to an amount makes the cached totals of our formulation stale
+        if name != "_formulation" and self._formulation is not None:
+            self._formulation.invalidate()
+
     def __repr__(self):
         return f"{type(self)} {self.smiles} - Mass: {self.mass}, Volume: {self.volume}, Moles {self.moles()}"
 
@@ -92,54 +290,228 @@ class ChemistryConverter:
         return self.mass / self.density
 
 
+class Role(Enum):
+    # Values are the names of the spreadsheet tabs the inputs come from
+    Monomer = "monomers"
+    Catalyst = "catalysts"
+    Inhibitor = "inhibitors"
+    Additive = "additives"
+    Solvent = "solvents"
+    Initiator = "chemical initiation"
+
+
+class Totals(NamedTuple):
+    """
+    The aggregates of a formulation that its per-component values are
+    relative to
+    """
+
+    monomer_mass: float
+    monomer_moles: float
+    monomer_volume: float
+    average_monomer_molecular_weight: float
+    catalyst_mass: float
+    catalyst_molecular_weight: float
+    additive_mass: float
+    additive_volume: float
+    solvent_mass: float
+
+
+def formulation_totals(
+    role: np.ndarray,
+    mass: np.ndarray,
+    volume: np.ndarray,
+    density: np.ndarray,
+    molecular_weight: np.ndarray,
+) -> Totals:
+    """
+    Work out the totals from per-component arrays. role holds Role values and
+    volume is NaN for components given by mass.
+    """
+    monomer = role == Role.Monomer.value
+    catalyst = role == Role.Catalyst.value
+    additive = role == Role.Additive.value
+    solvent = role == Role.Solvent.value
+    has_volume = ~np.isnan(volume)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        moles = mass / molecular_weight
+        monomer_moles = float(moles[monomer].sum())
+        return Totals(
+            monomer_mass=float(mass[monomer].sum()),
+            monomer_moles=monomer_moles,
+            monomer_volume=float((mass[monomer] / density[monomer]).sum()),
+            # Mole fraction weighted average
+            average_monomer_molecular_weight=float(
+                (moles[monomer] / monomer_moles * molecular_weight[monomer]).sum()
+            ),
+            catalyst_mass=float(mass[catalyst].sum()),
+            catalyst_molecular_weight=float(molecular_weight[catalyst].sum()),
+            additive_mass=float(mass[additive].sum()),
+            additive_volume=float(
+                np.where(
+                    has_volume[additive] & (volume[additive] != 0),
+                    volume[additive],
+                    mass[additive] / density[additive],
+                ).sum()
+            ),
+            # Solvents only count towards the total when given by volume
+            solvent_mass=float(
+                np.where(
+                    has_volume[solvent], volume[solvent] * density[solvent], 0.0
+                ).sum()
+            ),
+        )
+
+
+class Formulation:
+    """
+    The converters of one formulation grouped by role.
+
+    The totals used by the per-item ratio methods come from the same
+    formulation_totals() the StoichiometryEngine uses. They are computed once
+    and cached until a component is added or one of its amounts changes.
+    Those methods accept a Formulation anywhere they accept a list of
+    converters.
+    """
+
+    def __init__(
+        self,
+        monomers=(),
+        catalysts=(),
+        inhibitors=(),
+        additives=(),
+        solvents=(),
+        initiators=(),
+        track: bool = True,
+    ):
+        self.monomers = []
+        self.catalysts = []
+        self.inhibitors = []
+        self.additives = []
+        self.solvents = []
+        self.initiators = []
+
+        # A throwaway formulation built from plain lists doesn't register itself
+        # with its converters, so it can't steal them from a tracked one
+        self.track = track
+        self._totals = None
+
+        for converters in (
+            monomers,
+            catalysts,
+            inhibitors,
+            additives,
+            solvents,
+            initiators,
+        ):
+            for converter in converters:
+                self.add(converter)
+
+    def add(self, converter: ChemistryConverter):
+        if isinstance(converter, Monomer):
+            self.monomers.append(converter)
+        elif isinstance(converter, Catalyst):
+            self.catalysts.append(converter)
+        elif isinstance(converter, Inhibitor):
+            self.inhibitors.append(converter)
+        elif isinstance(converter, Additive):
+            self.additives.append(converter)
+        elif isinstance(converter, Solvent):
+            self.solvents.append(converter)
+        elif isinstance(converter, Initiator):
+            self.initiators.append(converter)
+        else:
+            raise TypeError(f"{type(converter)} has no role in a formulation")
+
+        if self.track:
+            converter._formulation = self
+        self.invalidate()
+
+    def invalidate(self):
+        self._totals = None
+
+    @property
+    def totals(self):
+        if self._totals is None:
+            components = [
+                (role, converter)
+                for role, converters in (
+                    (Role.Monomer, self.monomers),
+                    (Role.Catalyst, self.catalysts),
+                    (Role.Inhibitor, self.inhibitors),
+                    (Role.Additive, self.additives),
+                    (Role.Solvent, self.solvents),
+                    (Role.Initiator, self.initiators),
+                )
+                for converter in converters
+            ]
+            self._totals = formulation_totals(
+                np.array([role.value for role, _ in components]),
+                mass=np.array([c.mass or 0.0 for _, c in components], dtype=float),
+                volume=np.array(
+                    [np.nan if c.volume is None else c.volume for _, c in components],
+                    dtype=float,
+                ),
+                density=np.array([c.density for _, c in components], dtype=float),
+                molecular_weight=np.array(
+                    [c.molecular_weight for _, c in components], dtype=float
+                ),
+            )
+        return self._totals
+
+
+def as_formulation(converters, role: str) -> Formulation:
+    """
+    Accept either a Formulation or a plain collection of converters for the given
+    role
+    """
+    if isinstance(converters, Formulation):
+        return converters
+    return Formulation(**{role: converters}, track=False)
+
+
 class Monomer(ChemistryConverter):
+    __slots__ = ()
+
     def __init__(self, smiles: str, db: ChemDB, mass=None, volume=None):
         super().__init__(smiles, db, mass, volume)
 
-    def monomer_mol_percent(self, monomers: list) -> float:
-        denominator = sum([monomer.moles() for monomer in monomers])
+    def monomer_mol_percent(self, monomers) -> float:
+        denominator = as_formulation(monomers, "monomers").totals.monomer_moles
         monomer_mol_percent = (self.moles() / denominator) * 100.0
         return round(monomer_mol_percent, 2)
 
-    def monomer_volume(self, monomers: list) -> float:
-        return sum([monomer.m_volume() for monomer in monomers])
+    def monomer_volume(self, monomers) -> float:
+        return as_formulation(monomers, "monomers").totals.monomer_volume
 
-    def average_monomer_molecular_weight(self, monomers: list) -> float:
-        M_avg = 0
-        for monomer in monomers:
-            denominator = sum([monomer.moles() for monomer in monomers])
-            X_i = monomer.moles() / denominator
-            M_avg += X_i * monomer.molecular_weight
-        return M_avg
+    def average_monomer_molecular_weight(self, monomers) -> float:
+        totals = as_formulation(monomers, "monomers").totals
+        return totals.average_monomer_molecular_weight
 
 
 class Catalyst(ChemistryConverter):
+    __slots__ = ()
+
     def __init__(self, smiles: str, db: ChemDB, mass=None, volume=None):
         super().__init__(smiles, db, mass, volume)
 
-    def catalyst_monomer_molar_ratio(self, monomers: list) -> float:
-        sum_m_i = sum([monomer.mass for monomer in monomers])
-        numerator = sum_m_i / Monomer.average_monomer_molecular_weight(self, monomers)
+    def catalyst_monomer_molar_ratio(self, monomers) -> float:
+        totals = as_formulation(monomers, "monomers").totals
+        numerator = totals.monomer_mass / totals.average_monomer_molecular_weight
         catalyst_monomer_molar_ratio = numerator / (self.mass / self.molecular_weight)
         return round(catalyst_monomer_molar_ratio, 2)
 
 
 class Inhibitor(ChemistryConverter):
+    __slots__ = ()
+
     def __init__(self, smiles: str, db: ChemDB, mass=None, volume=None):
         super().__init__(smiles, db, mass, volume)
 
-    def inhibitor_catalyst_molar_ratio(self, catalysts: list[Catalyst]) -> float:
-        # iterate through the catalyst list and sum the mass. if mass is None use 0
-        catalysts_mass = sum(
-            [catalyst.mass if catalyst.mass else 0 for catalyst in catalysts]
-        )
-        catalysts_molecular_weight = sum(
-            [
-                catalyst.molecular_weight if catalyst.molecular_weight else 0
-                for catalyst in catalysts
-            ]
-        )
-        denominator = catalysts_mass / catalysts_molecular_weight
+    def inhibitor_catalyst_molar_ratio(self, catalysts) -> float:
+        totals = as_formulation(catalysts, "catalysts").totals
+        denominator = totals.catalyst_mass / totals.catalyst_molecular_weight
 
         inhibitor_mass = 0
         if self.mass:
@@ -154,6 +526,8 @@ class Inhibitor(ChemistryConverter):
 
 
 class Solvent(ChemistryConverter):
+    __slots__ = ()
+
     def __init__(self, smiles: str, db: ChemDB, mass=None, volume=None):
         super().__init__(smiles, db, mass, volume)
 
@@ -168,63 +542,52 @@ class Solvent(ChemistryConverter):
 
 
 class Additive(ChemistryConverter):
+    __slots__ = ()
+
     def __init__(self, smiles: str, db: ChemDB, mass=None, volume=None):
         super().__init__(smiles, db, mass, volume)
 
     def additive_weight_percent(
-        self, additives: list, monomers: list, catalysts: list, solvents: list
+        self, additives, monomers=None, catalysts=None, solvents=None
     ) -> float:
-        sum_m_i = sum([monomer.mass for monomer in monomers])
-        sum_catalysts_mass = sum(
-            [catalyst.mass if catalyst.mass else 0 for catalyst in catalysts]
-        )
-        sum_solvents_mass = sum(
-            [
-                (
-                    solvent.volume * solvent.density
-                    if solvent.volume is not None and solvent.density is not None
-                    else 0
-                )
-                for solvent in solvents
-            ]
-        )
+        # Only a Formulation as the first argument can stand in for the other roles
+        if isinstance(additives, Formulation):
+            monomers = additives if monomers is None else monomers
+            catalysts = additives if catalysts is None else catalysts
+            solvents = additives if solvents is None else solvents
+        elif monomers is None or catalysts is None or solvents is None:
+            raise TypeError(
+                "monomers, catalysts and solvents are required unless additives "
+                "is a Formulation"
+            )
 
         additive_weight_percent = (
             self.mass
             / (
-                sum_m_i
-                + sum([additive.mass for additive in additives])
-                + sum_catalysts_mass
-                + sum_solvents_mass
+                as_formulation(monomers, "monomers").totals.monomer_mass
+                + as_formulation(additives, "additives").totals.additive_mass
+                + as_formulation(catalysts, "catalysts").totals.catalyst_mass
+                + as_formulation(solvents, "solvents").totals.solvent_mass
             )
             * 100.0
         )
         return round(additive_weight_percent, 2)
 
-    def additive_volume_total(self, additives: list) -> float:
-        return sum(
-            [
-                (
-                    additive.volume
-                    if additive.volume
-                    else (additive.mass / additive.density)
-                )
-                for additive in additives
-            ]
-        )
+    def additive_volume_total(self, additives) -> float:
+        return as_formulation(additives, "additives").totals.additive_volume
 
-    def total_volume(
-        self, additives: list, monomers: list, inhibitor: Inhibitor, solvent: Solvent
-    ):
+    def total_volume(self, additives, monomers, inhibitor: Inhibitor, solvent: Solvent):
         return (
             self.additive_volume_total(additives)
-            + Monomer.monomer_volume(self, monomers)
+            + as_formulation(monomers, "monomers").totals.monomer_volume
             + inhibitor.volume
             + solvent.volume
         )
 
 
 class Initiator(ChemistryConverter):
+    __slots__ = ("role",)
+
     class InitiatorRole(Enum):
         Catalyst = "Catalyst"
         Solvent = "Solvent"
@@ -1,30 +1,41 @@
 #!/usr/bin/env python
 import json
 import sys
-from typing import Tuple, List, Dict
+from typing import Tuple, List, Dict, Optional
 from datetime import datetime
 
 
 from clowder_extractors.experiment_from_excel.chemistry import (
-    Monomer,
     ChemDB,
-    Catalyst,
-    Inhibitor,
-    Solvent,
-    Additive,
-    Initiator,
+    shared_chemdb,
 )
+from clowder_extractors.experiment_from_excel.stoichiometry import (
+    Role,
+    StoichiometryEngine,
+)
+from clowder_extractors.warmup import import_modules, load_chemdb, warm_up
 import logging
 
 import pyclowder.files
 from openpyxl import load_workbook
 from openpyxl.workbook import Workbook
+from openpyxl.worksheet._read_only import ReadOnlyWorksheet
 from openpyxl.worksheet.worksheet import Worksheet
 from pyclowder.extractors import Extractor
 from pyclowder.utils import CheckMessage
 
 moles_format = "{:.2e}"
 
+# Spreadsheet tabs that hold a list of chemical inputs
+input_tabs = [
+    "monomers",
+    "catalysts",
+    "inhibitors",
+    "additives",
+    "solvents",
+    "chemical initiation",
+]
+
 
 def microliters_to_milli(value):
     if value and value != "-":
@@ -53,13 +64,17 @@ def find_volume_column(row):
         return "Measured volume (μL)"
 
 
-def is_row_empty(row, input_title: str):
+def is_row_empty(row, input_title: str, mass_key: str = None, volume_key: str = None):
+    # Rows of a sheet share their columns, so callers can find the mass and
+    # volume columns once and pass them in
 
     if "SMILES" not in row:
         return True
 
-    mass_key = find_mass_column(row)
-    volume_key = find_volume_column(row)
+    if mass_key is None:
+        mass_key = find_mass_column(row)
+    if volume_key is None:
+        volume_key = find_volume_column(row)
 
     smiles = row["SMILES"] if row["SMILES"] else None
     name = row["Name"] if row["Name"] else None
@@ -93,176 +108,70 @@ def is_row_empty(row, input_title: str):
     return False
 
 
-def compute_values(inputs: dict, inputs_procedure: dict):
-    # First, create lists of input-specific chemistry converters with the observed values
-    db = ChemDB()
-
-    # MONOMERS
-    db.exists([compound["SMILES"] for compound in inputs["monomers"]])
-    monomers = {}
-    for compound in inputs["monomers"]:
-        if "Measured mass (g)" in compound:
-            measured_mass = compound["Measured mass (g)"]
-        elif compound.get("Measured mass (mg)") is not None:
-            # For monomer alone we will use (g)
-            measured_mass = compound["Measured mass (mg)"] / 1000.0  # Convert mg to g
-            compound["Measured mass (g)"] = (
-                measured_mass  # Add the key to the compound dict for further use
-            )
-        else:
-            measured_mass = None
-
-        monomers[compound["SMILES"]] = Monomer(
-            compound["SMILES"],
-            db,
-            mass_volume_conversion(measured_mass),
-            microliters_to_milli(
-                mass_volume_conversion(compound["Measured volume (μL)"])
-            ),
-        )
-
-    # CATALYSTS
-    db.exists([compound["SMILES"] for compound in inputs["catalysts"]])
-    catalysts = {}
-    for compound in inputs["catalysts"]:
-        if "Measured mass (g)" in compound:
-            measured_mass_g = compound["Measured mass (g)"]
-            compound["Measured mass (mg)"] = measured_mass_g * 1000.0  # Convert g to mg
-        elif compound.get("Measured mass (mg)") is not None:
-            measured_mass_g = compound["Measured mass (mg)"] / 1000.0
-        else:
-            measured_mass_g = None
-
-        catalysts[compound["SMILES"]] = Catalyst(
-            compound["SMILES"],
-            db,
-            mass_volume_conversion(measured_mass_g),
-            None,
-        )
-
-    # INHIBITORS
-    db.exists([compound["SMILES"] for compound in inputs["inhibitors"]])
-    inhibitors = {}
-    for compound in inputs["inhibitors"]:
-        if "Measured mass (g)" in compound:
-            measured_mass = compound["Measured mass (g)"]
-        elif compound.get("Measured mass (mg)") is not None:
-            measured_mass = compound["Measured mass (mg)"] / 1000.0
-            compound["Measured mass (g)"] = (
-                measured_mass  # Add the key to the compound dict for further use
-            )
-        else:
-            measured_mass = None  # Handle missing mass case
-
-        inhibitors[compound["SMILES"]] = Inhibitor(
-            compound["SMILES"],
-            db,
-            mass_volume_conversion(measured_mass),
-            microliters_to_milli(
-                mass_volume_conversion(compound["Measured volume (μL)"])
-            ),
-        )
-
-    # ADDITIVES
-    # will use (g) for calculation
-    db.exists([compound["SMILES"] for compound in inputs["additives"]])
-    additives = {}
-    for compound in inputs["additives"]:
-        if "Measured mass (g)" in compound:
-            measured_mass = compound["Measured mass (g)"]
-        elif compound.get("Measured mass (mg)") is not None:
-            measured_mass = compound["Measured mass (mg)"] / 1000.0  # Convert mg to g
-            compound["Measured mass (g)"] = measured_mass
-        else:
-            measured_mass = None
-
-        additives[compound["SMILES"]] = Additive(
-            compound["SMILES"],
-            db,
-            mass_volume_conversion(measured_mass),
-            microliters_to_milli(
-                mass_volume_conversion(compound["Measured volume (μL)"])
-            ),
-        )
-
-    # SOLVENTS
-    # will use (g) for calculation
-    db.exists([compound["SMILES"] for compound in inputs["solvents"]])
-    solvents = {}
-    for compound in inputs["solvents"]:
-        if "Measured mass (g)" in compound:
-            measured_mass = compound["Measured mass (g)"]
-            compound["Measured mass (mg)"] = (
-                measured_mass * 1000.0
-            )  # to display in meta-data for measured mass
-        elif compound.get("Measured mass (mg)") is not None:
-            measured_mass = compound["Measured mass (mg)"] / 1000.0
-            compound["Measured mass (g)"] = measured_mass
-        else:
-            measured_mass = None
-
-        solvents[compound["SMILES"]] = Solvent(
-            compound["SMILES"],
-            db,
-            mass_volume_conversion(measured_mass),
-            microliters_to_milli(
-                mass_volume_conversion(compound["Measured volume (μL)"])
-            ),
-        )
-
-    # INITIATORS
-    # will use  mg for calculation
-    db.exists([compound["SMILES"] for compound in inputs["chemical initiation"]])
-    initiators = {}
-    for compound in inputs["chemical initiation"]:
-        if "Measured mass (g)" in compound:
-            measured_mass = compound["Measured mass (g)"]
-        elif compound.get("Measured mass (mg)") is not None:
-            measured_mass = compound["Measured mass (mg)"] / 1000.0  # Convert mg to g
+def measured_amounts(
+    tab: str, compound: dict
+) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Return the measured (mass in g, volume in mL) of an input row. Calculations
+    use grams, so a mass given in mg is converted and the row is updated with
+    whichever mass unit its tab reports in the metadata.
+    """
+    if "Measured mass (g)" in compound:
+        measured_mass = compound["Measured mass (g)"]
+        if tab in ["catalysts", "solvents"]:
+            compound["Measured mass (mg)"] = measured_mass * 1000.0  # Convert g to mg
+    elif compound.get("Measured mass (mg)") is not None:
+        measured_mass = compound["Measured mass (mg)"] / 1000.0  # Convert mg to g
+        if tab != "catalysts":
             compound["Measured mass (g)"] = measured_mass
-        else:
-            measured_mass = None
-
-        initiators[compound["SMILES"]] = Initiator(
-            compound["SMILES"],
-            db,
-            mass=mass_volume_conversion(measured_mass),
-            volume=microliters_to_milli(
-                mass_volume_conversion(compound["Measured volume (μL)"])
-            ),
+    else:
+        measured_mass = None
+
+    # Catalysts are only ever weighed
+    measured_volume = (
+        None
+        if tab == "catalysts"
+        else microliters_to_milli(
+            mass_volume_conversion(compound["Measured volume (μL)"])
         )
-
-    total_initiator_catalyst_moles = sum(
-        initiator.moles()
-        for initiator in initiators.values()
-        if initiator.role == Initiator.InitiatorRole.Catalyst
-    )
-    total_initiator_catalyst_mg = sum(
-        initiator.mass
-        for initiator in initiators.values()
-        if initiator.role == Initiator.InitiatorRole.Catalyst
-    )
-    total_initiator_solvent_microliters = sum(
-        initiator.volume
-        for initiator in initiators.values()
-        if initiator.role == Initiator.InitiatorRole.Solvent
     )
+    return mass_volume_conversion(measured_mass), measured_volume
+
+
+def compute_values(inputs: dict, inputs_procedure: dict, db: ChemDB = None):
+    if not db:
+        db = shared_chemdb.get()
+
+    # Validate every input in one pass so that all of the unknown SMILES are
+    # reported together
+    db.exists([compound["SMILES"] for tab in input_tabs for compound in inputs[tab]])
+
+    # Load the observed amounts of every input into the stoichiometry engine,
+    # remembering which slot holds each row
+    engine = StoichiometryEngine(db)
+    slots = {
+        tab: [
+            engine.add(Role(tab), compound["SMILES"], *measured_amounts(tab, compound))
+            for compound in inputs[tab]
+        ]
+        for tab in input_tabs
+    }
 
     # Now compute derived values (which requires knowledge of all of the inputs)
+    values = engine.compute()
+
     monomer2 = [
         {
             "name": monomer["Name"],
             "SMILES": monomer["SMILES"],
             "Measured mass (g)": monomer["Measured mass (g)"],
             "Measured volume (μL)": monomer["Measured volume (μL)"],
-            "Computed mass (g)": monomers[monomer["SMILES"]].mass,
-            "Molecular Weight (g/mol)": monomers[monomer["SMILES"]].molecular_weight,
-            "Moles": moles_format.format(monomers[monomer["SMILES"]].moles()),
-            "Monomer mol%": monomers[monomer["SMILES"]].monomer_mol_percent(
-                monomers.values()
-            ),
+            "Computed mass (g)": values.mass[slot],
+            "Molecular Weight (g/mol)": values.molecular_weight[slot],
+            "Moles": moles_format.format(values.moles[slot]),
+            "Monomer mol%": values.monomer_mol_percent[slot],
         }
-        for monomer in inputs["monomers"]
+        for monomer, slot in zip(inputs["monomers"], slots["monomers"])
     ]
 
     catalyst2 = [
@@ -270,14 +179,12 @@ def compute_values(inputs: dict, inputs_procedure: dict):
             "name": catalyst["Name"],
             "SMILES": catalyst["SMILES"],
             "Measured mass (mg)": catalyst["Measured mass (mg)"],
-            "Computed mass (g)": catalysts[catalyst["SMILES"]].mass,
-            "Molecular Weight (g/mol)": catalysts[catalyst["SMILES"]].molecular_weight,
-            "Moles": moles_format.format(catalysts[catalyst["SMILES"]].moles()),
-            "Monomer:Catalyst molar ratio": catalysts[
-                catalyst["SMILES"]
-            ].catalyst_monomer_molar_ratio(monomers.values()),
+            "Computed mass (g)": values.mass[slot],
+            "Molecular Weight (g/mol)": values.molecular_weight[slot],
+            "Moles": moles_format.format(values.moles[slot]),
+            "Monomer:Catalyst molar ratio": values.catalyst_monomer_molar_ratio[slot],
         }
-        for catalyst in inputs["catalysts"]
+        for catalyst, slot in zip(inputs["catalysts"], slots["catalysts"])
     ]
 
     inhibitor2 = [
@@ -285,17 +192,15 @@ def compute_values(inputs: dict, inputs_procedure: dict):
             "name": inhibitor["Name"],
             "SMILES": inhibitor["SMILES"],
             "Measured volume (μL)": inhibitor["Measured volume (μL)"],
-            "Density": inhibitors[inhibitor["SMILES"]].density,
-            "Computed mass (g)": inhibitors[inhibitor["SMILES"]].mass,
-            "Molecular Weight (g/mol)": inhibitors[
-                inhibitor["SMILES"]
-            ].molecular_weight,
-            "Moles": moles_format.format(inhibitors[inhibitor["SMILES"]].moles()),
-            "Inhibitor:Catalyst molar ratio": inhibitors[
-                inhibitor["SMILES"]
-            ].inhibitor_catalyst_molar_ratio(list(catalysts.values())),
+            "Density": values.density[slot],
+            "Computed mass (g)": values.mass[slot],
+            "Molecular Weight (g/mol)": values.molecular_weight[slot],
+            "Moles": moles_format.format(values.moles[slot]),
+            "Inhibitor:Catalyst molar ratio": values.inhibitor_catalyst_molar_ratio[
+                slot
+            ],
         }
-        for inhibitor in inputs["inhibitors"]
+        for inhibitor, slot in zip(inputs["inhibitors"], slots["inhibitors"])
     ]
 
     additive2 = [
@@ -304,19 +209,12 @@ def compute_values(inputs: dict, inputs_procedure: dict):
             "SMILES": additive["SMILES"],
             "Measured mass (g)": additive["Measured mass (g)"],
             "Measured volume (μL)": additive["Measured volume (μL)"],
-            "Computed mass (g)": additives[additive["SMILES"]].mass,
-            "Molecular Weight (g/mol)": additives[additive["SMILES"]].molecular_weight,
-            "Moles": moles_format.format(additives[additive["SMILES"]].moles()),
-            "Wt Percent of Additives": additives[
-                additive["SMILES"]
-            ].additive_weight_percent(
-                list(additives.values()),
-                list(monomers.values()),
-                list(catalysts.values()),
-                list(solvents.values()),
-            ),
+            "Computed mass (g)": values.mass[slot],
+            "Molecular Weight (g/mol)": values.molecular_weight[slot],
+            "Moles": moles_format.format(values.moles[slot]),
+            "Wt Percent of Additives": values.additive_weight_percent[slot],
         }
-        for additive in inputs["additives"]
+        for additive, slot in zip(inputs["additives"], slots["additives"])
     ]
 
     solvents2 = [
@@ -325,37 +223,33 @@ def compute_values(inputs: dict, inputs_procedure: dict):
             "SMILES": solvent["SMILES"],
             "Measured mass (mg)": solvent["Measured mass (mg)"],
             "Measured volume (μL)": solvent["Measured volume (μL)"],
-            "Computed mass (g)": solvents[solvent["SMILES"]].mass,
-            "Molecular Weight (g/mol)": solvents[solvent["SMILES"]].molecular_weight,
-            "Moles": moles_format.format(solvents[solvent["SMILES"]].moles()),
-            "Solvent concentration (mL/g)": (
-                solvents[solvent["SMILES"]].solvent_concentration(
-                    list(catalysts.values())[0]
-                )
-                if catalysts.values()
-                else None
-            ),
+            "Computed mass (g)": values.mass[slot],
+            "Molecular Weight (g/mol)": values.molecular_weight[slot],
+            "Moles": moles_format.format(values.moles[slot]),
+            "Solvent concentration (mL/g)": values.solvent_concentration[slot],
         }
-        for solvent in inputs["solvents"]
+        for solvent, slot in zip(inputs["solvents"], slots["solvents"])
     ]
 
     chemical_initiation2 = [
         {
             "name": chemical_initiation["Name"],
             "SMILES": chemical_initiation["SMILES"],
-            "Role": initiators[chemical_initiation["SMILES"]].role.value,
+            "Role": values.initiator_role[slot],
             "Measured mass (mg)": chemical_initiation["Measured mass (mg)"],
             "Measured volume (μL)": chemical_initiation["Measured volume (μL)"],
-            "Molecular Weight (g/mol)": initiators[
-                chemical_initiation["SMILES"]
-            ].molecular_weight,
-            "Moles": moles_format.format(
-                initiators[chemical_initiation["SMILES"]].moles()
-            ),
+            "Molecular Weight (g/mol)": values.molecular_weight[slot],
+            "Moles": moles_format.format(values.moles[slot]),
         }
-        for chemical_initiation in inputs["chemical initiation"]
+        for chemical_initiation, slot in zip(
+            inputs["chemical initiation"], slots["chemical initiation"]
+        )
     ]
 
+    total_initiator_catalyst_moles = values.initiator_catalyst_moles
+    total_initiator_catalyst_mg = values.initiator_catalyst_mass
+    total_initiator_solvent_microliters = values.initiator_solvent_volume
+
     inputs["monomers"] = {
         "monomer-inputs": monomer2,
         "monomer-procedure": inputs_procedure["monomers"],
@@ -402,34 +296,66 @@ def serialize_dates(data):
             serialize_dates(value)
 
 
+def sheet_size(ws: Worksheet) -> Tuple[Optional[int], Optional[int]]:
+    """
+    The number of rows and columns to read from a sheet. Read-only sheets take
+    their size from the <dimension> element, which can be missing or stale, so
+    they are measured from their cells the same way a loaded sheet is.
+    """
+    if not isinstance(ws, ReadOnlyWorksheet):
+        return ws.max_row, ws.max_column
+
+    ws.reset_dimensions()
+    max_row = max_column = 0
+    for index, row in enumerate(ws.iter_rows(values_only=True), start=1):
+        if row:
+            max_row = index
+            max_column = max(max_column, len(row))
+    return max_row or None, max_column or None
+
+
 def read_inputs_from_worksheet(ws: Worksheet) -> Tuple[List[Dict], Dict]:
     # The inputs sheets contain rows of inputs and then a procedure block
     # that applies to all of the inputs of that type
     inputs = []
     procedure = {}
     inside_procedure_block = False
-    headers = [col.value for col in list(ws.rows)[0]]
-    for row in ws.iter_rows(min_row=2):
-        if row[0].value == "PROCEDURE":
+    max_row, max_column = sheet_size(ws)
+    rows = ws.iter_rows(values_only=True, max_row=max_row, max_col=max_column)
+    headers = tuple(next(rows, ()))
+    mass_key = find_mass_column(headers)
+    volume_key = find_volume_column(headers)
+    # Read-only sheets can return missing rows as empty lists
+    padding = (None,) * len(headers)
+    for row in rows:
+        row = tuple(row) + padding[len(row) :]
+        if row and row[0] == "PROCEDURE":
             inside_procedure_block = True
             continue
 
         if not inside_procedure_block:
-            input_properties = {key: cell.value for key, cell in zip(headers, row)}
-
-            if not is_row_empty(input_properties, input_title=ws.title):
+            input_properties = dict(zip(headers, row))
+
+            if not is_row_empty(
+                input_properties,
+                input_title=ws.title,
+                mass_key=mass_key,
+                volume_key=volume_key,
+            ):
                 inputs.append(input_properties)
         else:
-            if row[0].value:
-                procedure[row[0].value] = row[1].value
+            if row[0]:
+                procedure[row[0]] = row[1]
 
     return inputs, procedure
 
 
 def read_procedure_from_worksheet(ws: Worksheet) -> dict:
     procedure = {}
-    for row in ws.iter_rows():
-        procedure[row[0].value] = row[1].value
+    max_row, _ = sheet_size(ws)
+    for row in ws.iter_rows(values_only=True, max_row=max_row, max_col=2):
+        row = tuple(row) + (None, None)[len(row) :]
+        procedure[row[0]] = row[1]
 
     return procedure
 
@@ -440,10 +366,19 @@ def read_batch_id(wb: Workbook) -> str:
     return batch_id_cell.value
 
 
-def excel_to_json(path):
+def excel_to_json(path, db: ChemDB = None):
+    # Stream the cell values; only a workbook that will be edited needs to be
+    # loaded in full
+    wb = load_workbook(filename=path, read_only=True, data_only=True)
+    try:
+        return workbook_to_json(wb, db)
+    finally:
+        wb.close()
+
+
+def workbook_to_json(wb: Workbook, db: ChemDB = None):
     logging.getLogger("__main__")
 
-    wb = load_workbook(filename=path, data_only=True)
     # Find the data input spreadsheet version
     ss_version = [
         prop.value for prop in wb.custom_doc_props.props if prop.name == "File Version"
@@ -490,7 +425,7 @@ def excel_to_json(path):
                 wb[sheet]
             )
 
-    compute_values(inputs, inputs_procedure)
+    compute_values(inputs, inputs_procedure, db)
 
     # Clean up irrelevant procedure data
     if procedure["general"]["Photocontrol?"] == "NO":
@@ -542,13 +477,20 @@ class ExperimentFromExcel(Extractor):
         logging.getLogger("pyclowder").setLevel(logging.DEBUG)
         logging.getLogger("__main__").setLevel(logging.DEBUG)
 
+        # Keep the shared chemistry database current without blocking messages
+        shared_chemdb.start_refresh()
+
     def check_message(self, connector, host, secret_key, resource, parameters):
         logging.getLogger(__name__).debug("default check message : " + str(parameters))
         return CheckMessage.download
 
     def process_message(self, connector, host, secret_key, resource, parameters):
         logger = logging.getLogger("__main__")
-        experiment = excel_to_json(resource["local_paths"][0])
+        # Use the same database snapshot for the whole message, even if the
+        # background refresh swaps in a new one meanwhile
+        db = shared_chemdb.get()
+        experiment = excel_to_json(resource["local_paths"][0], db)
+        experiment["Chemistry database"] = db.describe()
         logger.debug(experiment)
 
         # store results as metadata
@@ -580,6 +522,7 @@ def main():
         print(json.dumps(experiment, indent=4, default=str, ensure_ascii=False))
     else:
         extractor = ExperimentFromExcel()
+        warm_up([import_modules("openpyxl"), load_chemdb()])
         extractor.start()
 
 
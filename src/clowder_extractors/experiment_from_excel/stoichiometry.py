@@ -0,0 +1,230 @@
+from typing import List
+
+import numpy as np
+
+from clowder_extractors.experiment_from_excel.chemistry import (
+    ChemDB,
+    Initiator,
+    Role,
+    formulation_totals,
+)
+
+
+def round_values(values: np.ndarray) -> List[float]:
+    # Round with Python's round() so results match the per-item converters exactly
+    return [round(value, 2) for value in values.tolist()]
+
+
+class Stoichiometry:
+    """
+    Derived values for every component of a formulation, indexed by the slot
+    numbers returned from StoichiometryEngine.add(). Values that don't apply to
+    a component's role are None.
+    """
+
+    def __init__(self, size: int):
+        self.mass = [None] * size
+        self.molecular_weight = [None] * size
+        self.density = [None] * size
+        self.moles = [None] * size
+        self.monomer_mol_percent = [None] * size
+        self.catalyst_monomer_molar_ratio = [None] * size
+        self.inhibitor_catalyst_molar_ratio = [None] * size
+        self.additive_weight_percent = [None] * size
+        self.solvent_concentration = [None] * size
+        self.initiator_role = [None] * size
+
+        self.initiator_catalyst_moles = 0.0
+        self.initiator_catalyst_mass = 0.0
+        self.initiator_solvent_volume = 0.0
+
+
+class StoichiometryEngine:
+    """
+    Batched equivalent of the Monomer/Catalyst/... converters in chemistry.py.
+
+    Components are collected with add() and then compute() loads them into
+    arrays of mass (g), volume (mL), density, molecular weight and role and
+    works out every derived value in a handful of vectorized passes.
+    """
+
+    def __init__(self, db: ChemDB):
+        self.db = db
+        self.roles = []
+        self.smiles = []
+        self.masses = []
+        self.volumes = []
+        self._slots = {}
+
+    def __len__(self):
+        return len(self.smiles)
+
+    def add(self, role: Role, smiles: str, mass=None, volume=None) -> int:
+        """
+        Add a component and return its slot number. A SMILES that appears twice
+        on the same tab shares one slot, and the last amount given wins.
+        """
+        mass = None if mass == "-" else mass
+        volume = None if volume == "-" else volume
+
+        if not mass and not volume:
+            raise ValueError("Volume or mass must be specified")
+
+        if not smiles:
+            raise ValueError("Smiles field must be specified")
+
+        if mass and volume:
+            raise ValueError("Only specify one of mass or volume")
+
+        slot = self._slots.get((role, smiles))
+        if slot is None:
+            slot = len(self.smiles)
+            self._slots[(role, smiles)] = slot
+            self.roles.append(role)
+            self.smiles.append(smiles)
+            self.masses.append(mass)
+            self.volumes.append(volume)
+        else:
+            self.masses[slot] = mass
+            self.volumes[slot] = volume
+        return slot
+
+    def compute(self) -> Stoichiometry:
+        result = Stoichiometry(len(self))
+        if not len(self):
+            return result
+
+        records = [self.db.records[smiles] for smiles in self.smiles]
+        molecular_weight = np.array(
+            [record.molecular_weight for record in records], dtype=float
+        )
+        density = np.array([record.density for record in records], dtype=float)
+        role = np.array([role.value for role in self.roles])
+
+        has_mass = np.array([bool(mass) for mass in self.masses])
+        has_volume = np.array([volume is not None for volume in self.volumes])
+        given_mass = np.array(
+            [mass if mass else 0.0 for mass in self.masses], dtype=float
+        )
+        volume = np.array(
+            [volume if volume is not None else np.nan for volume in self.volumes],
+            dtype=float,
+        )
+
+        # Mass from volume is zero when the density is unknown
+        mass = np.where(
+            has_mass,
+            given_mass,
+            np.where(np.isnan(density), 0.0, volume * density),
+        )
+        moles = mass / molecular_weight
+
+        result.mass = [
+            given if given else computed
+            for given, computed in zip(self.masses, mass.tolist())
+        ]
+        result.molecular_weight = molecular_weight.tolist()
+        result.density = density.tolist()
+        result.moles = moles.tolist()
+
+        monomer = role == Role.Monomer.value
+        catalyst = role == Role.Catalyst.value
+        inhibitor = role == Role.Inhibitor.value
+        additive = role == Role.Additive.value
+        solvent = role == Role.Solvent.value
+        initiator = role == Role.Initiator.value
+
+        totals = formulation_totals(role, mass, volume, density, molecular_weight)
+
+        if monomer.any():
+            self._scatter(
+                result.monomer_mol_percent,
+                monomer,
+                round_values(moles[monomer] / totals.monomer_moles * 100.0),
+            )
+
+        if catalyst.any():
+            monomer_molar_amount = (
+                totals.monomer_mass / totals.average_monomer_molecular_weight
+            )
+            self._scatter(
+                result.catalyst_monomer_molar_ratio,
+                catalyst,
+                round_values(
+                    monomer_molar_amount / (mass[catalyst] / molecular_weight[catalyst])
+                ),
+            )
+
+        if inhibitor.any():
+            catalyst_molar_amount = (
+                totals.catalyst_mass / totals.catalyst_molecular_weight
+            )
+            inhibitor_mass = np.where(
+                mass[inhibitor] != 0,
+                mass[inhibitor],
+                np.where(
+                    has_volume[inhibitor] & (density[inhibitor] != 0),
+                    volume[inhibitor] * density[inhibitor],
+                    0.0,
+                ),
+            )
+            self._scatter(
+                result.inhibitor_catalyst_molar_ratio,
+                inhibitor,
+                round_values(
+                    (inhibitor_mass / molecular_weight[inhibitor])
+                    / catalyst_molar_amount
+                ),
+            )
+
+        if additive.any():
+            total_mass = (
+                totals.monomer_mass
+                + totals.additive_mass
+                + totals.catalyst_mass
+                + totals.solvent_mass
+            )
+            self._scatter(
+                result.additive_weight_percent,
+                additive,
+                round_values(mass[additive] / total_mass * 100.0),
+            )
+
+        if solvent.any() and catalyst.any():
+            # Concentration is relative to the first catalyst in the formulation
+            first_catalyst_mass = mass[np.argmax(catalyst)]
+            solvent_volume = np.where(
+                has_volume[solvent],
+                volume[solvent],
+                mass[solvent] / density[solvent],
+            )
+            self._scatter(
+                result.solvent_concentration,
+                solvent,
+                round_values(solvent_volume / first_catalyst_mass),
+            )
+
+        if initiator.any():
+            # An initiator given by volume is acting as a solvent
+            by_volume = has_volume & (volume != 0)
+            initiator_solvent = initiator & by_volume
+            initiator_catalyst = initiator & ~by_volume
+            self._scatter(
+                result.initiator_role,
+                initiator,
+                np.where(
+                    by_volume[initiator],
+                    Initiator.InitiatorRole.Solvent.value,
+                    Initiator.InitiatorRole.Catalyst.value,
+                ).tolist(),
+            )
+            result.initiator_catalyst_moles = float(moles[initiator_catalyst].sum())
+            result.initiator_catalyst_mass = float(mass[initiator_catalyst].sum())
+            result.initiator_solvent_volume = float(volume[initiator_solvent].sum())
+
+        return result
+
+    @staticmethod
+    def _scatter(target: list, mask: np.ndarray, values: list):
+        for slot, value in zip(np.flatnonzero(mask).tolist(), values):
+            target[slot] = value
@@ -1,6 +1,12 @@
+import json
+import pickle
+
+import pandas
 import pytest
 from _pytest.fixtures import fixture
 
+from chemdb_snapshot import ChemDBSnapshot
+from stoichiometry import Role, StoichiometryEngine
 from chemistry import (
     ChemDB,
     ChemistryConverter,
@@ -9,6 +15,8 @@ from chemistry import (
     Inhibitor,
     Additive,
     Solvent,
+    SharedChemDB,
+    Formulation,
 )
 
 dicyclopentadiene = "C1C=CC2C1C3CC2C=C3"
@@ -19,6 +27,7 @@ gc2 = "CC1=CC(=C(C(=C1)C)N2CCN(C2=[Ru](=CC3=CC=CC=C3)(Cl)Cl)C4=C(C=C(C=C4C)C)C)C
 mn1 = "CC1=CC=CC2=CC=CC=C12"
 fumed_si = "O=[Si]=O"
 pbd = "C{-}C=CC{n+}"
+unreachable_url = "http://127.0.0.1:9/chemdb.csv"
 
 
 @fixture
@@ -197,3 +206,123 @@ def test_derived_values(db):
         additives[1].additive_weight_percent(additives, monomers, catalysts, solvents)
         == 0.03
     )
+
+
+def seed_snapshot(cache_dir) -> ChemDBSnapshot:
+    snapshot = ChemDBSnapshot(url=unreachable_url, cache_dir=str(cache_dir), ttl=0)
+    snapshot._write(
+        {"sha256": "seeded"},
+        pandas.DataFrame(
+            {
+                "SMILES": [dicyclopentadiene],
+                "Component": ["Dicyclopentadiene"],
+                "Abbreviation": ["DCPD"],
+                "Mwt. (g/mol)": [132.2],
+                "Density (g/mL)": [0.98],
+            }
+        ),
+    )
+    return snapshot
+
+
+def test_snapshot_served_offline(tmp_path):
+    # Box is unreachable and the TTL has expired, so the last snapshot is used
+    offline_db = ChemDB(seed_snapshot(tmp_path))
+    assert offline_db.exists(dicyclopentadiene)
+    assert offline_db.molecular_weight(dicyclopentadiene) == 132.2
+    assert offline_db.snapshot.info["sha256"] == "seeded"
+
+
+def test_snapshot_stored_as_json(tmp_path):
+    snapshot = seed_snapshot(tmp_path)
+    with open(snapshot.path) as f:
+        assert json.load(f)["info"] == {"sha256": "seeded"}
+
+    # Anything else in its place is ignored, never unpickled
+    with open(snapshot.path, "wb") as f:
+        pickle.dump({"info": {}, "data": None}, f)
+    assert snapshot._read() == ({}, None)
+
+
+def test_snapshot_without_cache_or_network(tmp_path):
+    snapshot = ChemDBSnapshot(url=unreachable_url, cache_dir=str(tmp_path), ttl=0)
+    with pytest.raises(Exception):
+        snapshot.load()
+
+
+def test_shared_chemdb_reuses_instance():
+    shared = SharedChemDB()
+    # Reading the version doesn't load the database
+    assert shared.version is None
+    shared_db = shared.get()
+    assert shared.version == shared_db.version
+    assert shared.get() is shared_db
+    assert shared_db.describe()["Version"] == shared_db.version
+
+    # Reloading an unchanged snapshot keeps the current instance
+    shared.refresh()
+    assert shared.get() is shared_db
+
+
+def test_validate_reports_every_problem(db):
+    assert db.exists([dicyclopentadiene, enb, None])
+
+    with pytest.raises(ValueError) as excinfo:
+        db.exists([dicyclopentadiene, "Phlogiston", "Caloric"])
+    assert str(excinfo.value) == "Phlogiston, Caloric not in Chemistry Database"
+
+
+def test_abbreviation_lookup(db):
+    abbreviation = db.records[dicyclopentadiene].abbreviation
+    assert db.lookup_abbreviation(abbreviation.lower()) == (
+        db.name(dicyclopentadiene),
+        dicyclopentadiene,
+    )
+    assert db.lookup_abbreviation("Phlogiston") is None
+
+
+def test_stoichiometry_engine(db):
+    engine = StoichiometryEngine(db)
+    monomers = [
+        engine.add(Role.Monomer, dicyclopentadiene, mass=10.51),
+        engine.add(Role.Monomer, enb, mass=0.55),
+    ]
+    catalyst = engine.add(Role.Catalyst, gc2, mass=7.14 / 1000)
+    engine.add(Role.Solvent, mn1, volume=357.87)
+    additive = engine.add(Role.Additive, pbd, mass=0.12)
+    engine.add(Role.Additive, fumed_si, mass=0.59)
+
+    values = engine.compute()
+    assert [values.monomer_mol_percent[slot] for slot in monomers] == [94.56, 5.44]
+    assert values.catalyst_monomer_molar_ratio[catalyst] == 9997.09
+    assert values.additive_weight_percent[additive] == 0.03
+    assert values.monomer_mol_percent[catalyst] is None
+
+
+def test_formulation_totals(db):
+    formulation = Formulation(
+        monomers=[
+            Monomer(dicyclopentadiene, db, mass=10.51),
+            Monomer(enb, db, mass=0.55),
+        ],
+        catalysts=[Catalyst(gc2, db, mass=7.14 / 1000)],
+        solvents=[Solvent(mn1, db, volume=357.87)],
+        additives=[Additive(fumed_si, db, mass=0.59), Additive(pbd, db, mass=0.12)],
+    )
+
+    assert formulation.monomers[0].monomer_mol_percent(formulation) == 94.56
+    assert formulation.catalysts[0].catalyst_monomer_molar_ratio(formulation) == 9997.09
+    assert formulation.additives[1].additive_weight_percent(formulation) == 0.03
+
+    # Changing an amount drops the cached totals
+    formulation.monomers[1].mass = (
+        10.51 * db.molecular_weight(enb) / db.molecular_weight(dicyclopentadiene)
+    )
+    assert formulation.monomers[0].monomer_mol_percent(formulation) == 50.0
+
+    with pytest.raises(AttributeError):
+        formulation.monomers[0].color = "red"
+
+    # Only a Formulation can stand in for the other roles
+    with pytest.raises(TypeError):
+        formulation.additives[1].additive_weight_percent(formulation.additives)
@@ -0,0 +1,59 @@
+import re
+import zipfile
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+from remat_experiment_from_excel import (
+    read_inputs_from_worksheet,
+    read_procedure_from_worksheet,
+)
+
+
+def rewrite_dimension(source, target, dimension):
+    # Replace the <dimension> element of every sheet, or remove it
+    with zipfile.ZipFile(source) as zin, zipfile.ZipFile(target, "w") as zout:
+        for item in zin.infolist():
+            data = zin.read(item.filename)
+            if item.filename.startswith("xl/worksheets/"):
+                data = re.sub(rb"<dimension [^>]*/>", dimension, data)
+            zout.writestr(item, data)
+
+
+@pytest.fixture
+def datasheet(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "monomers"
+    ws.append(["Name", "SMILES", "Measured mass (g)"])
+    ws.append(["DCPD", "C1C=CC2C1C3CC2C=C3", 1.0])
+    ws.append([])
+    ws.append(["ENB", "CC=C1CC2CC1C=C2", 2.0])
+    ws.append(["PROCEDURE"])
+    ws.append(["Mix time", 5])
+    general = wb.create_sheet("general")
+    general.append(["Initiation method", "THERMAL"])
+    general.append([])
+    general.append(["Photocontrol?", "NO"])
+    path = tmp_path / "datasheet.xlsx"
+    wb.save(path)
+    return path
+
+
+@pytest.mark.parametrize(
+    "dimension", [b"", b'<dimension ref="A1:B2"/>'], ids=["missing", "stale"]
+)
+def test_read_only_sheets_ignore_dimension(datasheet, tmp_path, dimension):
+    loaded = load_workbook(datasheet, data_only=True)
+    rewritten = tmp_path / "rewritten.xlsx"
+    rewrite_dimension(datasheet, rewritten, dimension)
+    streamed = load_workbook(rewritten, read_only=True, data_only=True)
+
+    inputs, procedure = read_inputs_from_worksheet(streamed["monomers"])
+    assert [i["Name"] for i in inputs] == ["DCPD", "ENB"]
+    assert procedure == {"Mix time": 5}
+    assert (inputs, procedure) == read_inputs_from_worksheet(loaded["monomers"])
+    assert read_procedure_from_worksheet(
+        streamed["general"]
+    ) == read_procedure_from_worksheet(loaded["general"])
+    streamed.close()
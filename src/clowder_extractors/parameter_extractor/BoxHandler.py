@@ -1,7 +1,125 @@
+import json
 import os
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, NamedTuple, Optional, Tuple, TypeVar
+
 from boxsdk import Client, CCGAuth
 from boxsdk.exception import BoxAPIException
 
+# Optional file to keep the access token in, so restarted workers don't have to
+# authenticate again
+token_cache_path = os.getenv("BOX_TOKEN_CACHE")
+
+# Seconds before expiry at which an access token is replaced
+token_refresh_margin = float(os.getenv("BOX_TOKEN_REFRESH_MARGIN", 300))
+
+# Seconds a listing of a shared folder is used before it is fetched again
+folder_index_ttl = float(os.getenv("BOX_FOLDER_INDEX_TTL", 600))
+
+T = TypeVar("T")
+
+_box_handler: Optional["BoxHandler"] = None
+_box_handler_lock = threading.Lock()
+
+
+class CachedCCGAuth(CCGAuth):
+    """
+    CCG authentication that remembers when its access token expires. A token
+    that is about to expire is replaced before it is used, instead of after Box
+    rejects a request with it, and tokens are shared through token_cache_path
+    when that is set.
+    """
+
+    def __init__(self, *args, cache_path: Optional[str] = None, **kwargs):
+        self._cache_path = cache_path
+        self._expires_at = 0.0
+        super().__init__(*args, **kwargs)
+
+    @property
+    def access_token(self) -> Optional[str]:
+        return self._get_and_update_current_tokens()[0]
+
+    def _get_tokens(self) -> Tuple[Optional[str], Optional[str]]:
+        if self._access_token and self._is_fresh(self._expires_at):
+            return self._access_token, None
+        cached = self._read_cache()
+        if cached:
+            self._expires_at = cached["expires_at"]
+            return cached["access_token"], None
+        return None, None
+
+    def _execute_token_request(self, data, access_token, expect_refresh_token=True):
+        token_response = super()._execute_token_request(
+            data, access_token, expect_refresh_token
+        )
+        expires_in = (
+            token_response["expires_in"] if "expires_in" in token_response else 3600
+        )
+        self._expires_at = time.time() + float(expires_in)
+        return token_response
+
+    def _store_tokens(self, access_token, refresh_token):
+        super()._store_tokens(access_token, refresh_token)
+        if access_token:
+            self._write_cache(access_token)
+
+    @staticmethod
+    def _is_fresh(expires_at: float) -> bool:
+        return time.time() < expires_at - token_refresh_margin
+
+    def _read_cache(self) -> Optional[dict]:
+        if not self._cache_path:
+            return None
+        try:
+            with open(self._cache_path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (
+            not isinstance(cached, dict)
+            or cached.get("client_id") != self._client_id
+            or cached.get("enterprise_id") != self._enterprise_id
+            or not cached.get("access_token")
+            or not self._is_fresh(float(cached.get("expires_at", 0)))
+        ):
+            return None
+        return cached
+
+    def _write_cache(self, access_token: str):
+        if not self._cache_path:
+            return
+        directory = os.path.dirname(os.path.abspath(self._cache_path))
+        try:
+            # mkstemp creates the file readable only by this user
+            fd, staging = tempfile.mkstemp(dir=directory, prefix=".box-token-")
+            with os.fdopen(fd, "w") as f:
+                json.dump(
+                    {
+                        "client_id": self._client_id,
+                        "enterprise_id": self._enterprise_id,
+                        "access_token": access_token,
+                        "expires_at": self._expires_at,
+                    },
+                    f,
+                )
+            os.replace(staging, self._cache_path)
+        except OSError as e:
+            print(f"Could not cache the Box access token: {e}")
+
+
+class BoxFileEntry(NamedTuple):
+    id: str
+    sha1: Optional[str]
+    modified_at: Optional[str]
+
+
+class FolderIndex(NamedTuple):
+    folder_id: str
+    files: Dict[str, BoxFileEntry]
+    loaded_at: float
+
 
 class BoxHandler:
     def __init__(self):
@@ -13,6 +131,11 @@ class BoxHandler:
         - BOX_ENTERPRISE_ID (for CCG authentication with a Service Account)
           OR
         - BOX_USER_ID (for CCG authentication as a specific user, remove enterprise_id in this case)
+        Optionally:
+        - BOX_TOKEN_CACHE (file to share the access token through between restarts)
+        - BOX_TOKEN_REFRESH_MARGIN (seconds before expiry to replace the token, default 300)
+
+        Use get_box_handler() to share one authenticated client in the process.
         """
         self.client_id = os.getenv("BOX_CLIENT_ID", "rhtgt26vyj3fxa92c450iibqckolijfi")
         self.client_secret = os.getenv("BOX_TOKEN")
@@ -21,10 +144,11 @@ class BoxHandler:
         if not self.client_secret:
             raise ValueError("Missing environment variable: BOX_TOKEN")
 
-        auth = CCGAuth(
+        auth = CachedCCGAuth(
             client_id=self.client_id,
             client_secret=self.client_secret,
             enterprise_id=self.enterprise_id,
+            cache_path=token_cache_path,
         )
         try:
             self.client = Client(auth)
@@ -35,6 +159,10 @@ class BoxHandler:
                 print(f"Context Info: {e.context_info}")
             raise  # Re-raise the exception after printing details
 
+        # Listings of shared folders by link, see find_file_in_shared_link
+        self._folder_indexes: Dict[str, FolderIndex] = {}
+        self._folder_index_lock = threading.Lock()
+
     def _resolve_shared_link_to_folder_id(self, shared_link: str) -> str:
         """
         Resolves a Box shared link to its numeric folder ID.
@@ -51,6 +179,101 @@ class BoxHandler:
             print(f"Error resolving shared link '{shared_link}': {e.message}")
             raise
 
+    def _load_folder_index(self, shared_link: str) -> FolderIndex:
+        """
+        Lists the files in the folder behind a shared link.
+        """
+        folder_id = self._resolve_shared_link_to_folder_id(shared_link)
+        items = self.client.folder(folder_id).get_items(
+            fields=["type", "name", "sha1", "modified_at"]
+        )
+        files = {
+            item.name: BoxFileEntry(
+                item.id,
+                getattr(item, "sha1", None),
+                getattr(item, "modified_at", None),
+            )
+            for item in items
+            if item.type == "file"
+        }
+        return FolderIndex(folder_id, files, time.monotonic())
+
+    def prefetch_shared_link(self, shared_link: str):
+        """
+        Lists the folder behind a shared link ahead of the first lookup.
+        """
+        index = self._load_folder_index(shared_link)
+        with self._folder_index_lock:
+            self._folder_indexes[shared_link] = index
+
+    def find_file_in_shared_link(
+        self, shared_link: str, file_name: str
+    ) -> BoxFileEntry:
+        """
+        Looks up a file by its name in a folder specified by a shared link.
+
+        The folder listing is kept for BOX_FOLDER_INDEX_TTL seconds and shared
+        by every caller, so a lookup usually costs no Box API calls. The
+        listing is fetched again once it is older than that, or when the file
+        isn't in it.
+
+        Raises FileNotFoundError if the folder has no file with that name.
+        """
+        index = self._folder_indexes.get(shared_link)
+        if index and time.monotonic() - index.loaded_at < folder_index_ttl:
+            entry = index.files.get(file_name)
+            if entry:
+                return entry
+
+        with self._folder_index_lock:
+            # Another thread may have fetched the listing while this one waited
+            current = self._folder_indexes.get(shared_link)
+            if current is None or current is index:
+                current = self._load_folder_index(shared_link)
+                self._folder_indexes[shared_link] = current
+
+        entry = current.files.get(file_name)
+        if not entry:
+            raise FileNotFoundError(
+                f"Datasheet File '{file_name}' not found in Box folder (ID: {current.folder_id}) resolved from link '{shared_link}'."
+            )
+        return entry
+
+    def invalidate_shared_link(self, shared_link: str):
+        """
+        Drops the cached listing of a shared folder, so the next lookup
+        fetches it again.
+        """
+        with self._folder_index_lock:
+            self._folder_indexes.pop(shared_link, None)
+
+    def with_file_in_shared_link(
+        self,
+        shared_link: str,
+        file_name: str,
+        action: Callable[[BoxFileEntry], T],
+    ) -> T:
+        """
+        Calls action with the entry of a file in a shared folder and returns
+        its result.
+
+        A file that was deleted and uploaded again under the same name gets a
+        new ID, so Box answers 404 for the one in a cached listing. The
+        listing is then fetched again and action retried once with the new
+        entry.
+        """
+        entry = self.find_file_in_shared_link(shared_link, file_name)
+        try:
+            return action(entry)
+        except BoxAPIException as e:
+            if e.status != 404:
+                raise
+            print(
+                f"Box file '{file_name}' (ID: {entry.id}) is gone; listing the folder again"
+            )
+            self.invalidate_shared_link(shared_link)
+            return action(self.find_file_in_shared_link(shared_link, file_name))
+
     def download_file_by_name_from_shared_link(
         self, shared_link: str, file_name: str, temp_file_path: str
     ):
@@ -62,22 +285,13 @@ class BoxHandler:
             file_name (str): The name of the file to download from the folder.
             temp_file_path (str): The local path (including filename) where the file will be downloaded.
         """
-        try:
-            folder_id = self._resolve_shared_link_to_folder_id(shared_link)
-            items = self.client.folder(folder_id).get_items()
-            file_id_to_download = None
-            for item in items:
-                if item.type == "file" and item.name == file_name:
-                    file_id_to_download = item.id
-                    break
-
-            if not file_id_to_download:
-                raise FileNotFoundError(
-                    f"Datasheet File '{file_name}' not found in Box folder (ID: {folder_id}) resolved from link '{shared_link}'."
-                )
 
+        def download(entry: BoxFileEntry):
             with open(temp_file_path, "wb") as output_file:
-                self.client.file(file_id_to_download).download_to(output_file)
+                self.client.file(entry.id).download_to(output_file)
+
+        try:
+            self.with_file_in_shared_link(shared_link, file_name, download)
             print(f"File '{file_name}' downloaded successfully to {temp_file_path}")
 
         except FileNotFoundError:  # Re-raise FileNotFoundError specifically
@@ -92,3 +306,16 @@ class BoxHandler:
         except Exception as e:
             print(f"An unexpected error occurred while downloading from box: {e}")
             raise
+
+
+def get_box_handler() -> BoxHandler:
+    """
+    The BoxHandler shared by the whole process, so its access token and
+    connections are reused by every download
+    """
+    global _box_handler
+    if _box_handler is None:
+        with _box_handler_lock:
+            if _box_handler is None:
+                _box_handler = BoxHandler()
+    return _box_handler
@@ -0,0 +1,137 @@
+"""
+Local cache of the files an extractor derives from its input.
+
+When a message fails after its input was parsed, for example during an upload,
+RabbitMQ delivers it again. With the stripped CSV, plots and metadata cached
+under the input fingerprint the retry goes straight to the uploads.
+
+Each entry is a directory holding the artifact files and an artifacts.json with
+the metadata. Entries are written to a temporary directory and renamed into
+place, so readers never see a partial entry, and the least recently used
+entries are removed once there are more than ARTIFACT_CACHE_MAX_ENTRIES.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Dict, Iterable, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+METADATA_FILE = "artifacts.json"
+
+
+class CachedArtifacts(NamedTuple):
+    # Paths of the copied files by name, and the metadata stored with them
+    paths: Dict[str, str]
+    metadata: dict
+
+
+class ArtifactCache:
+    """
+    Configured through environment variables:
+        ARTIFACT_CACHE_DIR          - where entries are kept
+                                      (default <tempdir>/remat-artifacts)
+        ARTIFACT_CACHE_MAX_ENTRIES  - entries kept; 0 turns the cache off
+                                      (default 32)
+    """
+
+    def __init__(
+        self, directory: Optional[str] = None, max_entries: Optional[int] = None
+    ):
+        self.directory = directory or os.getenv(
+            "ARTIFACT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "remat-artifacts")
+        )
+        self.max_entries = int(
+            max_entries
+            if max_entries is not None
+            else os.getenv("ARTIFACT_CACHE_MAX_ENTRIES", 32)
+        )
+
+    @staticmethod
+    def key(*parts) -> str:
+        # Key for an input fingerprint plus anything else that changes the output
+        encoded = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str, directory: str) -> Optional[CachedArtifacts]:
+        """
+        Copy the files of a cached entry into directory. Returns None if there
+        is no complete entry for key.
+        """
+        if not self.max_entries:
+            return None
+
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, METADATA_FILE)) as f:
+                metadata = json.load(f)
+            paths = {
+                name: shutil.copy(os.path.join(entry, name), directory)
+                for name in os.listdir(entry)
+                if name != METADATA_FILE
+            }
+            # Mark the entry as recently used
+            os.utime(entry)
+        except (OSError, ValueError):
+            return None
+        return CachedArtifacts(paths, metadata)
+
+    def put(self, key: str, paths: Iterable[str], metadata: dict):
+        """
+        Store copies of the files at paths with their metadata. Failures are
+        logged; the cache is only an optimization.
+        """
+        if not self.max_entries:
+            return
+
+        staging = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            staging = tempfile.mkdtemp(dir=self.directory, prefix=".staging-")
+            for path in paths:
+                shutil.copy(path, staging)
+            with open(os.path.join(staging, METADATA_FILE), "w") as f:
+                json.dump(metadata, f, default=str)
+            os.rename(staging, self._entry(key))
+            staging = None
+        except OSError as e:
+            # Also raised if another worker stored the same entry first
+            logger.warning("Could not cache artifacts %s: %s", key, e)
+        finally:
+            if staging:
+                shutil.rmtree(staging, ignore_errors=True)
+
+        self._evict()
+
+    def discard(self, key: str):
+        """
+        Remove the entry for key, so the next put() stores a fresh one
+        """
+        shutil.rmtree(self._entry(key), ignore_errors=True)
+
+    def _evict(self):
+        try:
+            entries = sorted(
+                (
+                    entry
+                    for entry in os.scandir(self.directory)
+                    if entry.is_dir() and not entry.name.startswith(".")
+                ),
+                key=lambda entry: entry.stat().st_mtime,
+                reverse=True,
+            )
+        except OSError:
+            # An entry was removed by another worker while listing
+            return
+        for entry in entries[self.max_entries :]:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+artifact_cache = ArtifactCache()
@@ -1,9 +1,84 @@
-import requests
+import os
+import threading
 from logging import Logger
-from typing import List, Optional
+from typing import Iterable, List, Optional, Union
 
 import pyclowder.datasets
 
+from clowder_extractors.parameter_extractor.clowder_http import clowder_request
+
+
+class DatasetFileIndex:
+    """
+    The files of a dataset, listed once and then kept up to date as the
+    extractor deletes and uploads files, so one message costs one
+    `pyclowder.datasets.get_file_list(...)` call however many questions it asks.
+
+    The listing is fetched the first time it's needed. If that fails the error
+    is raised and the next question tries again.
+    """
+
+    def __init__(self, connector, host: str, secret_key: str, dataset_id: str):
+        self.connector = connector
+        self.host = host
+        self.secret_key = secret_key
+        self.dataset_id = dataset_id
+        self._files: Optional[List[dict]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def files(self) -> List[dict]:
+        with self._lock:
+            if self._files is None:
+                files = pyclowder.datasets.get_file_list(
+                    self.connector, self.host, self.secret_key, self.dataset_id
+                )
+                if not isinstance(files, list):
+                    files = []
+                self._files = [f for f in files if isinstance(f, dict)]
+            return list(self._files)
+
+    def filenames(self) -> List[str]:
+        return [
+            f["filename"]
+            for f in self.files
+            if isinstance(f.get("filename"), str) and f["filename"]
+        ]
+
+    def by_name(self, filename: str) -> List[dict]:
+        return [f for f in self.files if f.get("filename") == filename]
+
+    def by_extension(self, extensions: Union[str, Iterable[str]]) -> List[dict]:
+        # Extensions include the dot and are matched case insensitively
+        if isinstance(extensions, str):
+            extensions = [extensions]
+        extensions = tuple(extension.lower() for extension in extensions)
+        return [
+            f
+            for f in self.files
+            if isinstance(f.get("filename"), str)
+            and f["filename"].lower().endswith(extensions)
+        ]
+
+    def by_id(self, file_id: str) -> Optional[dict]:
+        return next((f for f in self.files if f.get("id") == file_id), None)
+
+    def added(self, file_id: str, path: str):
+        """
+        Record a file uploaded to the dataset
+        """
+        with self._lock:
+            if self._files is not None:
+                self._files.append({"id": file_id, "filename": os.path.basename(path)})
+
+    def removed(self, file_id: str):
+        """
+        Record a file deleted from the dataset
+        """
+        with self._lock:
+            if self._files is not None:
+                self._files = [f for f in self._files if f.get("id") != file_id]
+
 
 def dataset_has_xls_file(
     connector,
@@ -11,20 +86,23 @@ def dataset_has_xls_file(
     secret_key: str,
     dataset_id: str,
     logger: Optional[Logger] = None,
+    file_index: Optional[DatasetFileIndex] = None,
 ) -> bool:
     """
     Return True if the dataset already contains an .xls/.xlsx file.
 
-    Uses the `pyclowder` Python SDK to list dataset files via
+    Lists the dataset files through a DatasetFileIndex, which uses
     `pyclowder.datasets.get_file_list(...)`, then checks for spreadsheet extensions.
+    Pass in the message's index to reuse its listing.
     """
     if not dataset_id:
         return False
 
+    if file_index is None:
+        file_index = DatasetFileIndex(connector, host, secret_key, dataset_id)
+
     try:
-        files = pyclowder.datasets.get_file_list(
-            connector, host, secret_key, dataset_id
-        )
+        spreadsheets = file_index.by_extension((".xls", ".xlsx"))
     except Exception as e:
         if logger:
             logger.debug(
@@ -34,26 +112,15 @@ def dataset_has_xls_file(
             )
         return False
 
-    if not isinstance(files, list):
-        return False
-
-    filenames: List[str] = []
-    for f in files:
-        if not isinstance(f, dict):
-            continue
-        fname = f.get("filename")
-        if not isinstance(fname, str) or not fname:
-            continue
-
-        filenames.append(fname)
-
-        if fname.lower().endswith((".xls", ".xlsx")):
-            if logger:
-                logger.info("Found spreadsheet file in dataset: %s", fname)
-            return True
+    if spreadsheets:
+        if logger:
+            logger.info(
+                "Found spreadsheet file in dataset: %s", spreadsheets[0]["filename"]
+            )
+        return True
 
     if logger:
-        logger.info("filenames in dataset: %s", filenames)
+        logger.info("filenames in dataset: %s", file_index.filenames())
 
     return False
 
@@ -65,19 +132,22 @@ def delete_files_from_dataset_by_filename(
     dataset_id: str,
     filename: str,
     logger: Optional[Logger] = None,
+    file_index: Optional[DatasetFileIndex] = None,
 ) -> int:
     """
     Delete all files in a dataset matching the given filename.
 
-    Returns the number of deleted files.
+    Pass in the message's DatasetFileIndex to reuse its listing; deleted files
+    are removed from it. Returns the number of deleted files.
     """
     if not dataset_id or not filename:
         return 0
 
+    if file_index is None:
+        file_index = DatasetFileIndex(connector, host, secret_key, dataset_id)
+
     try:
-        files = pyclowder.datasets.get_file_list(
-            connector, host, secret_key, dataset_id
-        )
+        files = file_index.by_name(filename)
     except Exception as e:
         if logger:
             logger.warning(
@@ -88,24 +158,15 @@ def delete_files_from_dataset_by_filename(
             )
         return 0
 
-    if not isinstance(files, list):
-        return 0
-
-    to_delete: List[str] = []
-    for f in files:
-        if not isinstance(f, dict):
-            continue
-        if f.get("filename") == filename and f.get("id"):
-            to_delete.append(f["id"])
+    to_delete: List[str] = [f["id"] for f in files if f.get("id")]
 
     deleted = 0
     for file_id in to_delete:
         try:
             url = "%sapi/files/%s?key=%s" % (host, file_id, secret_key)
-            result = requests.delete(
-                url, verify=connector.ssl_verify if connector else True
-            )
+            result = clowder_request(connector, "DELETE", url)
             result.raise_for_status()
+            file_index.removed(file_id)
             deleted += 1
             if logger:
                 logger.info(
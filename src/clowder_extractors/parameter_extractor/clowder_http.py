@@ -0,0 +1,74 @@
+"""
+Shared HTTP client for the Clowder REST calls pyclowder doesn't cover.
+
+One requests.Session per process keeps connections to Clowder alive between
+calls. Requests time out, and idempotent requests are retried with jittered
+exponential backoff when Clowder answers 429 or 5xx or the connection fails.
+
+Configured through environment variables:
+    CLOWDER_HTTP_TIMEOUT    - seconds to wait for a response (default 60)
+    CLOWDER_HTTP_RETRIES    - retries per request (default 5)
+    CLOWDER_HTTP_POOL_SIZE  - connections kept open per host (default 10)
+"""
+
+import os
+import random
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+http_timeout = float(os.getenv("CLOWDER_HTTP_TIMEOUT", 60))
+http_retries = int(os.getenv("CLOWDER_HTTP_RETRIES", 5))
+http_pool_size = int(os.getenv("CLOWDER_HTTP_POOL_SIZE", 10))
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+class JitteredRetry(Retry):
+    """
+    Retry with "full jitter": sleep a random time up to the exponential
+    backoff, so workers that failed together don't retry together
+    """
+
+    def get_backoff_time(self) -> float:
+        return random.uniform(0, super().get_backoff_time())
+
+
+def clowder_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = JitteredRetry(
+                    total=http_retries,
+                    backoff_factor=0.5,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=frozenset(
+                        ["GET", "HEAD", "OPTIONS", "PUT", "DELETE"]
+                    ),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=http_pool_size,
+                    pool_maxsize=http_pool_size,
+                    max_retries=retry,
+                )
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def clowder_request(connector, method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Send a request through the shared session, verifying certificates the same
+    way as the connector
+    """
+    kwargs.setdefault("timeout", http_timeout)
+    kwargs.setdefault("verify", connector.ssl_verify if connector else True)
+    return clowder_session().request(method, url, **kwargs)
@@ -0,0 +1,178 @@
+import io
+import logging
+import os
+from typing import Iterable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from clowder_extractors.parameter_extractor.trios import (
+    DataPoint,
+    TriosEvent,
+    Variables,
+)
+
+logger = logging.getLogger(__name__)
+
+# Compact binary copy of the curve uploaded next to DSC_Curve.csv: parquet,
+# feather or off. Needs the optional pyarrow dependency
+curve_sidecar_format = os.getenv("DSC_CURVE_SIDECAR", "off")
+curve_sidecar_precision = os.getenv("DSC_CURVE_SIDECAR_PRECISION", "float32")
+
+
+class CurveArrays:
+    """
+    A DSC curve held as one typed array per column.
+
+    Rows are appended as they are parsed and the storage grows geometrically,
+    so building the curve costs amortized O(1) per point. Plotting and
+    statistics read the columns directly instead of re-reading DSC_Curve.csv.
+
+    Works as a TRIOS event consumer: the first Variables event names the
+    columns and each DataPoint event appends a row. Blank or non-numeric
+    readings are stored as NaN.
+    """
+
+    def __init__(
+        self,
+        columns: Optional[List[str]] = None,
+        dtype: Union[str, np.dtype] = np.float64,
+        capacity: int = 4096,
+    ):
+        self.dtype = np.dtype(dtype)
+        self.columns = None
+        self._size = 0
+        self._capacity = capacity
+        self._data = None
+        if columns is not None:
+            self.set_columns(columns)
+
+    def set_columns(self, columns: List[str]):
+        self.columns = list(columns)
+        self._data = np.empty((len(self.columns), self._capacity), dtype=self.dtype)
+
+    def __len__(self):
+        return self._size
+
+    def __call__(self, event: TriosEvent):
+        if isinstance(event, Variables) and self.columns is None:
+            self.set_columns(event.columns)
+        elif isinstance(event, DataPoint) and self.columns is not None:
+            self.append(event.values)
+
+    def append(self, values: Iterable[str]):
+        row = [to_float(value) for value in values]
+        width = len(self.columns)
+        row = (row + [np.nan] * width)[:width]
+
+        self._reserve(self._size + 1)
+        self._data[:, self._size] = row
+        self._size += 1
+
+    def extend(self, block: np.ndarray):
+        """
+        Append a block of rows, shaped (rows, columns)
+        """
+        self._reserve(self._size + len(block))
+        self._data[:, self._size : self._size + len(block)] = block.T
+        self._size += len(block)
+
+    def extend_csv(self, block: str):
+        """
+        Append a block of CSV text, as produced by iter_data_blocks()
+        """
+        width = len(self.columns)
+        numbers = pd.read_csv(
+            io.StringIO(block),
+            header=None,
+            names=range(width),
+            usecols=range(width),
+            skip_blank_lines=False,
+        )
+        numbers = numbers.apply(pd.to_numeric, errors="coerce")
+        self.extend(numbers.to_numpy(dtype=self.dtype))
+
+    def clear(self):
+        self._size = 0
+
+    def _reserve(self, size: int):
+        if size <= self._capacity:
+            return
+        while self._capacity < size:
+            self._capacity *= 2
+        grown = np.empty((len(self.columns), self._capacity), dtype=self.dtype)
+        grown[:, : self._size] = self._data[:, : self._size]
+        self._data = grown
+
+    def column(self, key: Union[str, int]) -> np.ndarray:
+        """
+        Return a column, by name or position, as a view on the stored data
+        """
+        index = self.columns.index(key) if isinstance(key, str) else key
+        return self._data[index, : self._size]
+
+    def to_frame(self, dtype: Union[str, np.dtype, None] = None) -> pd.DataFrame:
+        """
+        The curve as a DataFrame, optionally cast to another float precision
+        """
+        return pd.DataFrame(
+            {
+                name: self.column(index).astype(dtype or self.dtype, copy=False)
+                for index, name in enumerate(self.columns or [])
+            }
+        )
+
+    def max(self, key: Union[str, int]) -> float:
+        # Largest reading in a column, ignoring blanks; -inf if there are none
+        if self.columns is None:
+            return float("-inf")
+        values = self.column(key)
+        values = values[~np.isnan(values)]
+        return float(values.max()) if len(values) else float("-inf")
+
+
+def to_float(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def curve_sidecar_name(file_format: Optional[str] = None) -> Optional[str]:
+    # File name of the curve sidecar, or None if sidecars are turned off
+    file_format = (file_format or curve_sidecar_format).lower()
+    if file_format == "off":
+        return None
+    if file_format not in ("parquet", "feather"):
+        raise ValueError(f"Unknown curve sidecar format {file_format}")
+    return f"DSC_Curve.{file_format}"
+
+
+def write_curve_sidecar(
+    curve: CurveArrays,
+    directory: str,
+    file_format: Optional[str] = None,
+    precision: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Write the curve as a zstd compressed Parquet or Feather file named after
+    DSC_Curve.csv. Returns the path, or None if sidecars are turned off or
+    pyarrow isn't installed.
+    """
+    file_name = curve_sidecar_name(file_format)
+    if file_name is None:
+        return None
+
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        logger.warning("pyarrow is not installed; not writing %s", file_name)
+        return None
+
+    frame = curve.to_frame(precision or curve_sidecar_precision)
+    path = os.path.join(directory, file_name)
+    if file_name.endswith(".parquet"):
+        frame.to_parquet(path, compression="zstd", index=False)
+    else:
+        frame.to_feather(path, compression="zstd")
+    return path
@@ -0,0 +1,143 @@
+"""
+Fingerprints of extractor inputs, so files that were already extracted aren't
+extracted again.
+
+A fingerprint is the sha256 of the input file together with the extractor and
+chemistry database versions. It is uploaded as its own small metadata record
+once every other output has been uploaded, and a message whose fingerprint is
+already on the dataset is skipped, as long as the extracted DSC_Curve.csv, its
+preview and thumbnail, and the generated datasheet if there was one are still
+there. Submit the extraction with the parameter {"force": true}, or set
+FORCE_REEXTRACTION, to extract anyway.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from typing import Optional
+
+import pyclowder.datasets
+import pyclowder.files
+
+from clowder_extractors.parameter_extractor.clowder_dataset_helpers import (
+    DatasetFileIndex,
+)
+from clowder_extractors.parameter_extractor.clowder_http import clowder_request
+
+FINGERPRINT_KEY = "Input fingerprint"
+# Name of the datasheet uploaded with the fingerprint, if one was generated
+DATASHEET_KEY = "Generated datasheet"
+
+force_reextraction = os.getenv("FORCE_REEXTRACTION", "").lower() in ("1", "true", "yes")
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def input_fingerprint(
+    path: str, extractor_version: str, chemdb_version: Optional[str]
+) -> dict:
+    return {
+        "Input sha256": file_sha256(path),
+        "Extractor version": extractor_version,
+        "Chemistry database version": chemdb_version,
+    }
+
+
+def is_forced(message: dict) -> bool:
+    """
+    True if the extraction was submitted with {"force": true} or
+    FORCE_REEXTRACTION is set
+    """
+    if force_reextraction:
+        return True
+
+    submitted = message.get("parameters") if isinstance(message, dict) else None
+    if isinstance(submitted, str):
+        try:
+            submitted = json.loads(submitted)
+        except ValueError:
+            return False
+    if not isinstance(submitted, dict):
+        return False
+    return str(submitted.get("force", "")).lower() in ("1", "true", "yes")
+
+
+def has_preview_and_thumbnail(connector, host: str, secret_key: str, file_id: str):
+    # True if the file has a thumbnail and at least one preview
+    info = pyclowder.files.download_info(connector, host, secret_key, file_id)
+    if not isinstance(info, dict) or info.get("thumbnail") in (None, "", "None"):
+        return False
+
+    url = "%sapi/files/%s/listpreviews?key=%s" % (host, file_id, secret_key)
+    result = clowder_request(connector, "GET", url)
+    result.raise_for_status()
+    previews = result.json()
+    return isinstance(previews, list) and len(previews) > 0
+
+
+def already_extracted(
+    connector,
+    host: str,
+    secret_key: str,
+    dataset_id: str,
+    fingerprint: dict,
+    file_index: DatasetFileIndex,
+    logger: Optional[logging.Logger] = None,
+) -> bool:
+    """
+    True if the dataset's metadata holds this fingerprint and the outputs of
+    that extraction are still in the dataset: DSC_Curve.csv with its preview
+    and thumbnail, and the datasheet if one was generated. Any error answers
+    False so the file is extracted.
+    """
+    if not dataset_id:
+        return False
+
+    try:
+        # The dataset listing is needed by the message anyway, so that check is
+        # free. Then the fingerprint costs one round trip, and the previews of
+        # the outputs are only looked up once it matches.
+        curves = file_index.by_name("DSC_Curve.csv")
+        if not curves:
+            return False
+        metadata = pyclowder.datasets.download_metadata(
+            connector, host, secret_key, dataset_id
+        )
+        if not isinstance(metadata, list):
+            return False
+        extraction = next(
+            (
+                entry["content"]
+                for entry in metadata
+                if isinstance(entry, dict)
+                and isinstance(entry.get("content"), dict)
+                and entry["content"].get(FINGERPRINT_KEY) == fingerprint
+            ),
+            None,
+        )
+        if extraction is None:
+            return False
+
+        datasheet = extraction.get(DATASHEET_KEY)
+        if datasheet and not file_index.by_name(datasheet):
+            return False
+        return any(
+            curve.get("id")
+            and has_preview_and_thumbnail(connector, host, secret_key, curve["id"])
+            for curve in curves
+        )
+    except Exception as e:
+        if logger:
+            logger.warning(
+                "Could not check dataset %s for an earlier extraction: %s",
+                dataset_id,
+                e,
+            )
+        return False
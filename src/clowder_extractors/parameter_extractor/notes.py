@@ -1,8 +1,10 @@
 import logging
 from datetime import datetime
+from typing import Optional
 
-from clowder_extractors.experiment_from_excel.chemistry import ChemDB
+from clowder_extractors.experiment_from_excel.chemistry import ChemDB, shared_chemdb
 from openpyxl import load_workbook
+from openpyxl.workbook import Workbook
 
 
 logger = logging.getLogger(__name__)
@@ -12,8 +14,12 @@ class Notes:
     def __init__(self, parameters: dict):
         self.parameters = parameters
         self.notes = self.extract_notes_field()
-        self.chemDB = ChemDB()
+        self.chemDB = shared_chemdb.get()
         self.path = ""
+        # The datasheet at path, loaded once by open_workbook(), filled in
+        # memory and written back once by save()
+        self.workbook: Optional[Workbook] = None
+        self.edited = False
 
     def extract_notes_field(self) -> dict:
         parsed_dict = {}
@@ -26,12 +32,29 @@ class Notes:
                     parsed_dict[key.strip()] = val.strip()
         return parsed_dict
 
+    def open_workbook(self) -> Workbook:
+        self.workbook = load_workbook(filename=self.path, data_only=True)
+        self.edited = False
+        return self.workbook
+
+    def save(self):
+        if self.workbook is not None and self.edited:
+            self.workbook.save(self.path)
+            self.edited = False
+
     # Get input values from notes and map them to the experiment to be updated in excel sheet
     def map_input_values_from_notes_to_experiment(
         self, experiment: dict, initials: str
     ):
         if not self.notes or not experiment:
             return
+        try:
+            self._map_input_values(experiment, initials)
+        finally:
+            # Keep the edits made before any error, as when each one was saved
+            self.save()
+
+    def _map_input_values(self, experiment: dict, initials: str):
         # Fill date from notes into excel sheet
         self.add_date_batch_id_to_excel(initials)
 
@@ -57,13 +80,14 @@ class Notes:
                                     experiment["inputs"][exp_key],
                                     subKey,
                                     exp_key,
-                                    self.path,
+                                    self.workbook,
                                 )
+                                self.edited = True
                                 break
                     break
 
     def add_date_batch_id_to_excel(self, initials: str):
-        wb = load_workbook(filename=self.path, data_only=True)
+        wb = self.workbook
         date = self.notes.get("Mix Date and time", None)
         polymerization_date = self.notes.get("Polymerization Date and time", None)
         sheet = wb["general"]
@@ -78,8 +102,7 @@ class Notes:
             # get the TYPE: IA/LDM from exp
             batch_id = f"{parsed_date.day}-{parsed_date.month}-{parsed_date.year} {parsed_date.strftime('%H:%M')}  {initials}"
             sheet["E32"] = batch_id
-            # Save the workbook
-            wb.save(self.path)
+            self.edited = True
 
 
 #     Fill the values
@@ -88,11 +111,11 @@ def process_metadata_input(
     metadata_input: dict,
     subKey: str,
     excel_key: str,
-    worksheet_path: str,
+    workbook: Workbook,
 ):
 
     if not chemDB:
-        chemDB = ChemDB()
+        chemDB = shared_chemdb.get()
 
     records = metadata_input[subKey].split(", ")
     processed_records = []
@@ -101,17 +124,10 @@ def process_metadata_input(
     for record in records:
         smile = ""
         abbrev, mass = record.split(" ")
-        if abbrev and not chemDB.data.empty:
-            # use data and get column abbreviation
-            full_name = chemDB.data.loc[
-                chemDB.data["Abbreviation"].str.casefold() == abbrev.casefold(),
-                "Component",
-            ].values[0]
-            # dataframe has index built on SMILES attribute
-            smile = chemDB.data[
-                chemDB.data["Abbreviation"].str.casefold() == abbrev.casefold()
-            ].index[0]
-
+        match = chemDB.lookup_abbreviation(abbrev) if abbrev else None
+        if match:
+            # The abbreviation index maps to (component name, SMILES)
+            full_name, smile = match
         else:
             full_name = abbrev  # Default to the short name if not recognized
 
@@ -125,12 +141,11 @@ def process_metadata_input(
 
     metadata_input[subKey] = processed_records
     # Update the template excel sheet with the values from notes
-    update_excel_with_values(input_records, excel_key, worksheet_path)
+    update_excel_with_values(input_records, excel_key, workbook)
 
 
-# updates the excel sheet inplace for each input
-def update_excel_with_values(values, input_sheet: str, path: str):
-    wb = load_workbook(filename=path, data_only=True)
+# updates the workbook in memory for each input
+def update_excel_with_values(values, input_sheet: str, wb: Workbook):
     if input_sheet == "" or not input_sheet:
         return
     sheet = wb[input_sheet]
@@ -143,6 +158,3 @@ def update_excel_with_values(values, input_sheet: str, path: str):
         sheet.cell(row=row, column=1, value=full_name)
         sheet.cell(row=row, column=2, value=abbrv)
         sheet.cell(row=row, column=3, value=float(mass))
-
-    # Save the workbook
-    wb.save(path)
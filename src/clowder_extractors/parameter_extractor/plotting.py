@@ -0,0 +1,140 @@
+"""
+Heat Flow vs. Temperature previews for DSC curves.
+
+Plots are drawn on an Agg Figure owned by the calling thread rather than through
+pyplot's global state, so several messages can be plotted at once. Each plot is
+rasterized once at the preview resolution and the thumbnail is downscaled from
+that image in memory.
+
+Long runs are decimated before plotting to a few points per pixel column of the
+preview, keeping every local minimum and maximum, so render time and memory
+don't grow with the length of the run.
+"""
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Callable, Iterator, Tuple
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from PIL import Image
+
+PREVIEW_DPI = 300
+THUMBNAIL_DPI = 80
+
+_local = threading.local()
+
+# Renders previews while the extractors upload their other outputs
+render_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("PLOT_WORKERS", 2)), thread_name_prefix="plot"
+)
+
+
+@contextmanager
+def rendering(function: Callable[..., Tuple[str, str]], *args) -> Iterator[Future]:
+    """
+    Run a render on render_executor and wait for it to finish on exit, even
+    if the caller failed, so it never writes into a directory being removed
+    """
+    future = render_executor.submit(function, *args)
+    try:
+        yield future
+    finally:
+        wait([future])
+
+
+def _figure() -> Figure:
+    # One figure per thread, cleared and reused for every plot
+    figure = getattr(_local, "figure", None)
+    if figure is None:
+        figure = Figure()
+        FigureCanvasAgg(figure)
+        _local.figure = figure
+    figure.clear()
+    return figure
+
+
+def decimate(
+    x: np.ndarray, y: np.ndarray, buckets: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Split the curve into buckets of consecutive points and keep at most four
+    points of each: the first, last, lowest and highest, in their original
+    order. Peaks and steps keep their exact values, and with a bucket per pixel
+    column the line looks the same as the full curve. A blank reading in a
+    bucket is kept as well so gaps in the curve still show.
+    """
+    size = len(y)
+    if size <= 4 * buckets:
+        return x, y
+
+    width = -(-size // buckets)
+    padded = np.full(buckets * width, np.nan, dtype=float)
+    padded[:size] = y
+    padded = padded.reshape(buckets, width)
+    blank = np.isnan(padded)
+    blank.reshape(-1)[size:] = False
+
+    starts = np.arange(buckets) * width
+    keep = [
+        starts,
+        np.minimum(starts + width - 1, size - 1),
+        starts + np.argmin(np.where(np.isnan(padded), np.inf, padded), axis=1),
+        starts + np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis=1),
+        (starts + np.argmax(blank, axis=1))[blank.any(axis=1)],
+    ]
+    index = np.unique(np.concatenate(keep))
+    index = index[index < size]
+    return x[index], y[index]
+
+
+def render_heat_flow(temperature: np.ndarray, heat_flow: np.ndarray) -> Image.Image:
+    """
+    Rasterize the Heat Flow vs. Temperature graph at the preview resolution
+    """
+    figure = _figure()
+    figure.set_dpi(PREVIEW_DPI)
+
+    # One bucket per pixel column of the preview
+    buckets = int(figure.get_figwidth() * PREVIEW_DPI)
+    temperature, heat_flow = decimate(temperature, heat_flow, buckets)
+
+    axes = figure.add_subplot()
+    axes.plot(temperature, heat_flow)
+
+    # Add axis labels and title
+    axes.set_xlabel("Temperature")
+    axes.set_ylabel("Heat Flow")
+    axes.set_title("Heat Flow vs. Temperature")
+
+    figure.tight_layout()
+    figure.canvas.draw()
+    image = Image.fromarray(np.asarray(figure.canvas.buffer_rgba()).copy())
+    figure.clear()
+    return image
+
+
+def plot_heat_flow(
+    temperature: np.ndarray, heat_flow: np.ndarray, tmpdirname: str
+) -> Tuple[str, str]:
+    """
+    Write DSC_Curve.png and DSC_Curve_thumb.png to tmpdirname and return their
+    paths
+    """
+    image = render_heat_flow(temperature, heat_flow)
+
+    graph_file_path = os.path.join(tmpdirname, "DSC_Curve.png")
+    image.save(graph_file_path, format="png", dpi=(PREVIEW_DPI, PREVIEW_DPI))
+
+    scale = THUMBNAIL_DPI / PREVIEW_DPI
+    thumbnail = image.resize(
+        (round(image.width * scale), round(image.height * scale)),
+        Image.Resampling.LANCZOS,
+    )
+    thumb_file_path = os.path.join(tmpdirname, "DSC_Curve_thumb.png")
+    thumbnail.save(thumb_file_path, format="png", dpi=(THUMBNAIL_DPI, THUMBNAIL_DPI))
+
+    return graph_file_path, thumb_file_path
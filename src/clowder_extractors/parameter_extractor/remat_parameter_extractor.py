@@ -1,15 +1,13 @@
 #!/usr/bin/env python
 import copy
-import csv
 import logging
 import os
 import re
 import sys
 import tempfile
+from contextlib import ExitStack
 from logging import Logger
-from typing import Optional, TextIO, Tuple
-import pandas as pd
-import matplotlib.pyplot as plt
+from typing import Mapping, Optional, TextIO, Tuple
 import requests
 
 import pyclowder.files
@@ -20,47 +18,69 @@ import json
 
 
 # from clowder_extractors.experiment_from_excel.remat_experiment_from_excel import compute_values
+from clowder_extractors.experiment_from_excel.chemistry import shared_chemdb
 from clowder_extractors.experiment_from_excel.remat_experiment_from_excel import (
-    excel_to_json,
+    workbook_to_json,
 )
+from clowder_extractors.parameter_extractor.artifact_cache import artifact_cache
 from clowder_extractors.parameter_extractor.clowder_dataset_helpers import (
+    DatasetFileIndex,
     dataset_has_xls_file,
     delete_files_from_dataset_by_filename,
 )
+from clowder_extractors.parameter_extractor.fingerprint import (
+    DATASHEET_KEY,
+    FINGERPRINT_KEY,
+    already_extracted,
+    input_fingerprint,
+    is_forced,
+)
 from clowder_extractors.parameter_extractor.notes import Notes
-from clowder_extractors.parameter_extractor.BoxHandler import BoxHandler
+from clowder_extractors.parameter_extractor.BoxHandler import get_box_handler
+from clowder_extractors.parameter_extractor.curve import (
+    CurveArrays,
+    curve_sidecar_name,
+    write_curve_sidecar,
+)
+from clowder_extractors.parameter_extractor.plotting import (
+    plot_heat_flow,
+    rendering,
+)
+from clowder_extractors.parameter_extractor.trios import (
+    CurveCSVWriter,
+    ParameterCollector,
+    TriosLayoutError,
+    TriosSectionIndex,
+    Variables,
+    dispatch,
+    iter_data_blocks,
+    iter_trios_events,
+)
+from clowder_extractors.parameter_extractor.template_store import template_store
+from clowder_extractors.parameter_extractor.upload_pipeline import UploadPipeline
+from clowder_extractors.warmup import (
+    connect_box,
+    import_modules,
+    load_chemdb,
+    render_plot,
+    warm_up,
+)
 
 
 # Folder containing all datasheets - IF location changes, update the URL below in code
 # Must have read access to everyone and svc account
 datasheet_folder = "https://uofi.box.com/s/91pz5we1ywgz7iftail1c0bulfgriq2o"
 
+# Precision of the in-memory curve arrays (float64 or float32)
+curve_dtype = os.getenv("DSC_CURVE_DTYPE", "float64")
 
-def make_plot(dsc_file_path, tmpdirname):
-    # Plotting Heat Flow vs. Temperature graph
-    df = pd.read_csv(dsc_file_path)
-    # Reduce the number of columns down to what we need
-    df = df.loc[:, ["Temperature", "Heat Flow"]]
-    temperature = df["Temperature"].astype(float)
-    heat_flow = df["Heat Flow"].astype(float)
-
-    # Plot graph
-    plt.plot(temperature, heat_flow)
-
-    # Add axis labels and title
-    plt.xlabel("Temperature")
-    plt.ylabel("Heat Flow")
-    plt.title("Heat Flow vs. Temperature")
 
-    # Save output image files
-    plt.tight_layout()
-    graph_file_path = os.path.join(tmpdirname, "DSC_Curve.png")
-    plt.savefig(graph_file_path, format="png", dpi=300)
-    thumb_file_path = os.path.join(tmpdirname, "DSC_Curve_thumb.png")
-    plt.savefig(thumb_file_path, format="png", dpi=80)
+def make_plot(curve: CurveArrays, tmpdirname):
+    # Plotting Heat Flow vs. Temperature graph
+    temperature = curve.column("Temperature")
+    heat_flow = curve.column("Heat Flow")
 
-    plt.close()
-    return graph_file_path, thumb_file_path
+    return plot_heat_flow(temperature, heat_flow, tmpdirname)
 
 
 def extract_baseline_temps(baseline_cursor_x: list[str]) -> (float, float):
@@ -72,76 +92,58 @@ def strip_units(param: str) -> float:
     return float(param.strip().split(" ")[0])
 
 
+def read_trios_file(
+    path: str, dsc_file: TextIO, curve: CurveArrays, logger: Logger
+) -> Mapping[str, dict]:
+    """
+    Index the header sections and copy the data points to dsc_file and curve.
+    The data block is parsed in bulk; exports with an unusual layout are read
+    line by line instead.
+    """
+    sections = TriosSectionIndex(path)
+    csv_writer = CurveCSVWriter(dsc_file)
+    try:
+        data_block = sections.data_block()
+        if data_block is not None:
+            dispatch([Variables(data_block.columns)], csv_writer, curve)
+            with open(path, "rb") as data_file:
+                data_file.seek(data_block.start)
+                for block in iter_data_blocks(data_file, data_block.end):
+                    csv_writer.write_block(block)
+                    curve.extend_csv(block)
+        return sections
+    except TriosLayoutError as e:
+        logger.info(f"Reading {path} line by line: {e}")
+
+    dsc_file.seek(0)
+    dsc_file.truncate()
+    curve.clear()
+    collector = ParameterCollector()
+    with open(path, "r") as param_file:
+        dispatch(
+            iter_trios_events(param_file),
+            collector,
+            CurveCSVWriter(dsc_file),
+            curve,
+        )
+    return collector.parameters
+
+
 def extract_parameters(
     path: str,
     dsc_file: TextIO,
     logger: Logger,
     temp_dir: str,
     skip_notes_and_excel: bool = False,
+    curve: Optional[CurveArrays] = None,
 ) -> Tuple[dict, Optional[str]]:
-    section_re = re.compile(r"\[(.*)]$")
-    parameters = {}
-
-    stripped_csv = csv.writer(dsc_file)
-    heat_flow_column = None
-    max_heat_flow = float("-inf")
-
-    with open(path, "r") as param_file:
-        section = None
-        header_written = False
-        for line in param_file:
-            m = section_re.match(line)
-            if m:
-                section = m.group(1)
-                parameters[section] = {}
-            else:
-                if section != "Step":
-                    line_value = line.strip("\n").split("\t")
-                    if len(line_value) == 2:
-                        (key, value) = line.strip("\n").split("\t")
-                        if key not in parameters[section]:
-                            parameters[section][key] = value
-                        else:
-                            parameters[section][key] = [parameters[section][key]] + [
-                                value
-                            ]
-                    # Special case for the Project line
-                    elif len(line_value) == 1 and line_value[0] == "Project":
-                        parameters[section]["Project"] = " ".join(line_value)
-
-                else:
-                    # This line is part of the DSC output. Copy lines
-                    # to the DSC_File.csv file
-                    line_values = line.strip("\n").split("\t")
-
-                    # The first column contains the line type
-                    line_type = line_values[0]
-
-                    # Remove the first column - it contains the line type
-                    line_values = line_values[1:]
-
-                    if line_type == "Variables" and not header_written:
-                        # Remember the column number for the heat flow, skipping
-                        # the first column (which contained the line type)
-                        heat_flow_column = find_heat_flow_column(line_values)
-
-                        # Write the header line
-                        stripped_csv.writerow(line_values)
-
-                        # We might see another header in the file. Don't write it out
-                        header_written = True
-
-                    elif line_type == "Data point":
-                        # See if we have a new max heat flow, but beware of blank lines
-                        if (
-                            heat_flow_column is not None
-                            and line_values[heat_flow_column] != ""
-                        ):
-                            heat_flow = float(line_values[heat_flow_column])
-                            if heat_flow > max_heat_flow:
-                                max_heat_flow = heat_flow
-
-                        stripped_csv.writerow(line.strip("\n").split("\t")[1:])
+    # Index the header sections, which are only parsed when looked up, and copy
+    # the curve to the DSC_Curve.csv file and into columnar arrays. Pass in a
+    # CurveArrays to reuse them for plotting.
+    if curve is None:
+        curve = CurveArrays()
+    parameters = read_trios_file(path, dsc_file, curve, logger)
+    max_heat_flow = curve.max("Heat Flow")
 
     is_postcure = parameters["Analysis"]["Model"] == "Glass transition"
 
@@ -242,15 +244,20 @@ def extract_parameters(
     initials = template_datasheet.split("_")[1]
 
     # Download the datasheet file for the given space
-    pd, datasheet_file = read_data_sheet_file(template_datasheet + ".xlsx", temp_dir)
+    datasheet_file = read_data_sheet_file(template_datasheet + ".xlsx", temp_dir)
     trios_notes.path = datasheet_file
 
     if not trios_notes.notes:
         logger.debug("No notes found in the TRIOS file")
 
-    # Add the inputs object and Batch ID from experiment_from_excel to the experiment object
+    # Record which chemistry snapshot was used to fill in the datasheet
+    experiment_to_upload["Chemistry database"] = trios_notes.chemDB.describe()
+
+    # Add the inputs object and Batch ID from experiment_from_excel to the experiment object.
+    # The datasheet is loaded once, read, filled in from the notes and saved once
     try:
-        result_from_excel = excel_to_json(datasheet_file)
+        workbook = trios_notes.open_workbook()
+        result_from_excel = workbook_to_json(workbook, trios_notes.chemDB)
         if result_from_excel is None:
             logger.debug("Error: result_from_excel is None")
         elif "inputs" not in result_from_excel:
@@ -322,11 +329,6 @@ def find_max_temp_and_ramp_rate(log_entries: dict) -> (float, float):
     )
 
 
-def find_heat_flow_column(line_values: list[str]) -> int:
-    heat_flow_column = [i for i, x in enumerate(line_values) if x == "Heat Flow"][0]
-    return heat_flow_column
-
-
 def extract_notes_field(parameters: dict) -> dict:
     parsed_dict = {}
     if "Sample" in parameters and "Notes" in parameters["Sample"]:
@@ -339,27 +341,21 @@ def extract_notes_field(parameters: dict) -> dict:
     return parsed_dict
 
 
-def read_data_sheet_file(file_name: str, temp_dir: str) -> (pd.DataFrame, str):
+def read_data_sheet_file(file_name: str, temp_dir: str) -> Optional[str]:
 
     try:
-        # Use the BoxHandler class to get the Box client
-        box_handler = BoxHandler()
-
+        # Copy the template from the local store, which only downloads it
+        # from Box when it has changed
         temp_file_path = os.path.join(temp_dir, file_name)
-        box_handler.download_file_by_name_from_shared_link(
-            shared_link=datasheet_folder,
-            file_name=file_name,
-            temp_file_path=temp_file_path,
+        template_store.fetch(
+            get_box_handler(), datasheet_folder, file_name, temp_file_path
         )
 
-        # Read the downloaded file into a pandas DataFrame
-        df = pd.read_excel(temp_file_path)
-
-        return df, temp_file_path
+        return temp_file_path
 
     except requests.exceptions.RequestException as e:
         print(f"An error occurred while downloading the file: {e}")
-        return None, None
+        return None
 
 
 class ParameterExtractor(Extractor):
@@ -373,19 +369,49 @@ class ParameterExtractor(Extractor):
         logging.getLogger("pyclowder").setLevel(logging.DEBUG)
         logging.getLogger("__main__").setLevel(logging.DEBUG)
 
+        # Keep the shared chemistry database current without blocking messages
+        shared_chemdb.start_refresh()
+
     def check_message(self, connector, host, secret_key, resource, parameters):
         return CheckMessage.download
 
     def process_message(self, connector, host, secret_key, resource, parameters):
         logger = logging.getLogger("__main__")
-        with tempfile.TemporaryDirectory() as tmpdirname:
+        # The render is waited for before the temporary directory is removed
+        with tempfile.TemporaryDirectory() as tmpdirname, ExitStack() as renders:
             dsc_file_path = os.path.join(tmpdirname, "DSC_Curve.csv")
             dataset_id = resource["parent"].get("id", None)
+            # List the dataset's files once for this message
+            file_index = DatasetFileIndex(connector, host, secret_key, dataset_id)
+
+            # Skip files that were already extracted with the same versions
+            fingerprint = input_fingerprint(
+                resource["local_paths"][0],
+                self.extractor_info["version"],
+                # Loaded by warm_up(), so reading it doesn't wait on a load
+                shared_chemdb.version,
+            )
+            forced = is_forced(parameters)
+            if not forced and already_extracted(
+                connector, host, secret_key, dataset_id, fingerprint, file_index, logger
+            ):
+                connector.message_process(
+                    resource,
+                    "Input file unchanged since it was last extracted; skipping. Submit with force to extract again.",
+                )
+                return
+
             connector.message_process(
                 resource, "Checking dataset for existing DSC_Curve.csv..."
             )
             deleted_count = delete_files_from_dataset_by_filename(
-                connector, host, secret_key, dataset_id, "DSC_Curve.csv", logger
+                connector,
+                host,
+                secret_key,
+                dataset_id,
+                "DSC_Curve.csv",
+                logger,
+                file_index,
             )
             if deleted_count > 0:
                 connector.message_process(
@@ -396,9 +422,20 @@ class ParameterExtractor(Extractor):
                 connector.message_process(
                     resource, "No existing DSC_Curve.csv found; creating DSC_Curve.csv."
                 )
+            sidecar_name = curve_sidecar_name()
+            if sidecar_name:
+                delete_files_from_dataset_by_filename(
+                    connector,
+                    host,
+                    secret_key,
+                    dataset_id,
+                    sidecar_name,
+                    logger,
+                    file_index,
+                )
 
             is_xls_file_present = dataset_has_xls_file(
-                connector, host, secret_key, dataset_id, logger
+                connector, host, secret_key, dataset_id, logger, file_index
             )
             if is_xls_file_present:
                 connector.message_process(
@@ -411,45 +448,99 @@ class ParameterExtractor(Extractor):
                     "No datasheet found in dataset; will use Notes if present to create the datasheet.",
                 )
 
-            with open(dsc_file_path, "w") as dsc_file:
+            # Reuse what an earlier delivery of this message derived from the
+            # file. A forced extraction parses it again and replaces the entry.
+            cache_key = artifact_cache.key(
+                fingerprint, is_xls_file_present, curve_sidecar_name()
+            )
+            if forced:
+                artifact_cache.discard(cache_key)
+                cached = None
+            else:
+                cached = artifact_cache.get(cache_key, tmpdirname)
+            if cached is not None:
                 connector.message_process(
-                    resource, "Extracting parameters from text file..."
+                    resource, "Reusing parameters and plots extracted earlier..."
                 )
-                parameters, datasheet_file = extract_parameters(
-                    resource["local_paths"][0],
-                    dsc_file,
-                    logger,
-                    tmpdirname,
-                    skip_notes_and_excel=is_xls_file_present,
+                artifacts = cached.paths
+                parameters = cached.metadata["parameters"]
+                datasheet_file = artifacts.get(cached.metadata["datasheet"])
+
+                def render():
+                    return artifacts["DSC_Curve.png"], artifacts["DSC_Curve_thumb.png"]
+
+                def write_sidecar():
+                    return artifacts.get(curve_sidecar_name())
+
+            else:
+                curve = CurveArrays(dtype=curve_dtype)
+                with open(dsc_file_path, "w") as dsc_file:
+                    connector.message_process(
+                        resource, "Extracting parameters from text file..."
+                    )
+                    parameters, datasheet_file = extract_parameters(
+                        resource["local_paths"][0],
+                        dsc_file,
+                        logger,
+                        tmpdirname,
+                        skip_notes_and_excel=is_xls_file_present,
+                        curve=curve,
+                    )
+
+                # Render the plot while the CSV uploads
+                render = renders.enter_context(
+                    rendering(make_plot, curve, tmpdirname)
+                ).result
+
+                def write_sidecar():
+                    return write_curve_sidecar(curve, tmpdirname)
+
+            pipeline = UploadPipeline(logger)
+
+            def upload(path):
+                uploaded_id = pyclowder.files.upload_to_dataset(
+                    connector, host, secret_key, dataset_id, path
                 )
+                file_index.added(uploaded_id, path)
+                return uploaded_id
 
             # Upload the extracted CSV file
-            dataset_id = resource["parent"].get("id", None)
             connector.message_process(resource, "Uploading extracted DSC_Curve.csv...")
-            uploaded_id = pyclowder.files.upload_to_dataset(
-                connector,
-                host,
-                secret_key,
-                dataset_id,
-                dsc_file_path,
-            )
+            pipeline.add("DSC_Curve.csv", lambda: upload(dsc_file_path))
 
-            # Make a plot and thumbnail of the plot
-            graph_file_path, thumb_file_path = make_plot(dsc_file_path, tmpdirname)
+            # Upload a compact binary copy of the curve alongside the CSV
+            def upload_sidecar(sidecar_file_path):
+                if sidecar_file_path:
+                    upload(sidecar_file_path)
+                return sidecar_file_path
 
-            # Attach to our uploaded CSV file
-            pyclowder.files.upload_preview(
-                connector,
-                host,
-                secret_key,
-                fileid=uploaded_id,
-                previewfile=graph_file_path,
-                preview_mimetype="image/png",
+            pipeline.add("curve sidecar file", write_sidecar)
+            pipeline.add(
+                "curve sidecar", upload_sidecar, depends_on=["curve sidecar file"]
             )
 
-            pyclowder.files.upload_thumbnail(
-                connector, host, secret_key, uploaded_id, thumb_file_path
+            # Attach the plot and thumbnail of the plot to our uploaded CSV file
+            pipeline.add("plot", render)
+            pipeline.add(
+                "preview",
+                lambda uploaded_id, plot_files: pyclowder.files.upload_preview(
+                    connector,
+                    host,
+                    secret_key,
+                    fileid=uploaded_id,
+                    previewfile=plot_files[0],
+                    preview_mimetype="image/png",
+                ),
+                depends_on=["DSC_Curve.csv", "plot"],
             )
+            pipeline.add(
+                "thumbnail",
+                lambda uploaded_id, plot_files: pyclowder.files.upload_thumbnail(
+                    connector, host, secret_key, uploaded_id, plot_files[1]
+                ),
+                depends_on=["DSC_Curve.csv", "plot"],
+            )
+
             # Only upload a datasheet if we generated/downloaded one in this run.
             # If the dataset already had a spreadsheet, keep the extractor idempotent.
             if (not is_xls_file_present) and datasheet_file:
@@ -460,9 +551,7 @@ class ParameterExtractor(Extractor):
                 logger.info("uploading datasheet file to dataset %s", datasheet_file)
                 temp_datasheet_path = os.path.join(tmpdirname, datasheet_file)
 
-                pyclowder.files.upload_to_dataset(
-                    connector, host, secret_key, dataset_id, temp_datasheet_path, False
-                )
+                pipeline.add("datasheet", lambda: upload(temp_datasheet_path))
             elif is_xls_file_present:
                 connector.message_process(
                     resource,
@@ -474,29 +563,72 @@ class ParameterExtractor(Extractor):
                     "Notes not provided or incorrect; returning base parameter metadata only (no datasheet upload).",
                 )
 
-        logger.debug(parameters)
-
-        # store results as metadata
-        metadata = {
-            "@context": ["https://clowder.ncsa.illinois.edu/contexts/metadata.jsonld"],
-            "dataset_id": resource["parent"].get("id", None),
-            "content": parameters,
-            "agent": {
-                "@type": "cat:extractor",
-                "extractor_id": host + "api/extractors/" + self.extractor_info["name"],
-            },
-        }
-        # Add extractor metadata to dataset
-        try:
-            pyclowder.datasets.upload_metadata(
-                connector,
-                host,
-                secret_key,
-                resource["parent"].get("id", None),
-                metadata,
+            logger.debug(parameters)
+
+            def dataset_metadata(content: dict) -> dict:
+                return {
+                    "@context": [
+                        "https://clowder.ncsa.illinois.edu/contexts/metadata.jsonld"
+                    ],
+                    "dataset_id": dataset_id,
+                    "content": content,
+                    "agent": {
+                        "@type": "cat:extractor",
+                        "extractor_id": host
+                        + "api/extractors/"
+                        + self.extractor_info["name"],
+                    },
+                }
+
+            # store results as metadata
+            metadata = dataset_metadata(parameters)
+            # Add extractor metadata to dataset. A failure here is only logged
+            pipeline.add(
+                "metadata",
+                lambda: pyclowder.datasets.upload_metadata(
+                    connector, host, secret_key, dataset_id, metadata
+                ),
+                critical=False,
             )
-        except Exception as e:
-            logger.error("Error uploading metadata: %s", e, exc_info=True)
+
+            # Record the extraction once every other upload succeeded, so a
+            # redelivered message extracts the file again if one failed
+            extraction = {FINGERPRINT_KEY: fingerprint}
+            if "datasheet" in pipeline.stages:
+                extraction[DATASHEET_KEY] = os.path.basename(datasheet_file)
+            pipeline.add(
+                "fingerprint",
+                lambda *uploaded: pyclowder.datasets.upload_metadata(
+                    connector,
+                    host,
+                    secret_key,
+                    dataset_id,
+                    dataset_metadata(extraction),
+                ),
+                depends_on=list(pipeline.stages),
+                critical=False,
+            )
+
+            # Keep the derived files in case this message is delivered again,
+            # whether or not their uploads succeed
+            if cached is None:
+                pipeline.add(
+                    "artifact cache",
+                    lambda plot_files, sidecar_file_path: artifact_cache.put(
+                        cache_key,
+                        [dsc_file_path, *plot_files]
+                        + [p for p in (sidecar_file_path, datasheet_file) if p],
+                        {
+                            "parameters": parameters,
+                            "datasheet": datasheet_file
+                            and os.path.basename(datasheet_file),
+                        },
+                    ),
+                    depends_on=["plot", "curve sidecar file"],
+                    critical=False,
+                )
+
+            pipeline.run()
 
 
 def main():
@@ -504,13 +636,24 @@ def main():
         logger = logging.getLogger("__main__")
         with tempfile.TemporaryDirectory() as tmpdirname:
             dsc_file_path = os.path.join(tmpdirname, "DSC_Curve.csv")
+            curve = CurveArrays(dtype=curve_dtype)
             with open(dsc_file_path, "w") as dsc_file:
-                extract_parameters(sys.argv[1], dsc_file, logger, tmpdirname)
-            make_plot(dsc_file_path, tmpdirname)
+                extract_parameters(
+                    sys.argv[1], dsc_file, logger, tmpdirname, curve=curve
+                )
+            make_plot(curve, tmpdirname)
             # find_volume_column()
             print(tmpdirname)
     else:
         extractor = ParameterExtractor()
+        warm_up(
+            [
+                import_modules("pandas", "openpyxl", "matplotlib"),
+                render_plot(),
+                load_chemdb(),
+                connect_box(datasheet_folder),
+            ]
+        )
         extractor.start()
 
 
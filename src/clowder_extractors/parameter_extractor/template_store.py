@@ -0,0 +1,123 @@
+"""
+Local store of the datasheet templates kept in Box.
+
+The same few templates are filled in for thousands of TRIOS files, so each one
+is downloaded once per version and copied into the message's directory after
+that. Stored files are named after the sha1 of their content, which Box lists
+with every file, so a template is only downloaded again when it changes in Box.
+
+Downloads are written to a temporary file, checked against their sha1 and
+renamed into place, so workers sharing the directory never copy a partial
+template. Older versions of a template are removed once a new one is stored.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _HashingWriter:
+    # File wrapper that computes the sha1 of what is written through it
+    def __init__(self, file):
+        self.file = file
+        self.sha1 = hashlib.sha1()
+
+    def write(self, data: bytes):
+        self.sha1.update(data)
+        return self.file.write(data)
+
+
+class TemplateStore:
+    """
+    Configured through environment variables:
+        DATASHEET_TEMPLATE_DIR  - where templates are kept
+                                  (default <tempdir>/remat-datasheet-templates)
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or os.getenv(
+            "DATASHEET_TEMPLATE_DIR",
+            os.path.join(tempfile.gettempdir(), "remat-datasheet-templates"),
+        )
+
+    def _stored(self, file_name: str, sha1: str) -> str:
+        return os.path.join(self.directory, f"{sha1}_{file_name}")
+
+    def fetch(
+        self, box_handler, shared_link: str, file_name: str, destination: str
+    ) -> str:
+        """
+        Copy the current version of file_name in the shared Box folder to
+        destination, downloading it only if this version isn't stored yet.
+        Returns destination.
+        """
+
+        def copy(entry) -> str:
+            stored = entry.sha1 and self._stored(file_name, entry.sha1)
+            if stored:
+                try:
+                    shutil.copyfile(stored, destination)
+                    return destination
+                except FileNotFoundError:
+                    # Not stored yet, or removed for a newer version
+                    pass
+
+            self._download(box_handler, shared_link, entry, file_name, destination)
+            return destination
+
+        # Lists the folder again and retries if the file was replaced in Box
+        return box_handler.with_file_in_shared_link(shared_link, file_name, copy)
+
+    def _download(
+        self, box_handler, shared_link: str, entry, file_name: str, destination: str
+    ):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, staging = tempfile.mkstemp(dir=self.directory, prefix=".download-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                writer = _HashingWriter(f)
+                box_handler.client.file(entry.id).download_to(writer)
+            sha1 = writer.sha1.hexdigest()
+            stored = self._stored(file_name, sha1)
+            # Copy from the download itself: once stored, another worker may
+            # remove the file for an even newer version at any time
+            shutil.copyfile(staging, destination)
+            os.replace(staging, stored)
+        except BaseException:
+            os.remove(staging)
+            raise
+        logger.info("Stored datasheet template %s version %s", file_name, sha1)
+
+        if entry.sha1 and sha1 != entry.sha1:
+            # The template changed since the folder was listed. Keep what was
+            # downloaded, it is the current version, and list the folder again
+            # so later lookups find it under its new sha1
+            logger.warning(
+                "Box listed %s with sha1 %s but the download has %s",
+                file_name,
+                entry.sha1,
+                sha1,
+            )
+            box_handler.invalidate_shared_link(shared_link)
+
+        self._remove_older_versions(file_name, stored)
+
+    def _remove_older_versions(self, file_name: str, current: str):
+        version = re.compile(r"[0-9a-f]{40}_" + re.escape(file_name))
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if version.fullmatch(name) and path != current:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Another worker removed it first
+                    pass
+
+
+template_store = TemplateStore()
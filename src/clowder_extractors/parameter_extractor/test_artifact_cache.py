@@ -0,0 +1,46 @@
+import os
+
+from artifact_cache import ArtifactCache
+
+
+def test_round_trip_and_eviction(tmp_path):
+    work = tmp_path / "work"
+    work.mkdir()
+    (work / "DSC_Curve.csv").write_text("1,2,3\n")
+    cache = ArtifactCache(str(tmp_path / "cache"), max_entries=2)
+
+    keys = [ArtifactCache.key({"Input sha256": str(i)}, False) for i in range(3)]
+    for age, key in enumerate(keys):
+        cache.put(key, [str(work / "DSC_Curve.csv")], {"parameters": {"key": key}})
+        # Older entries were used longer ago
+        os.utime(cache._entry(key), (age, age))
+
+    restored = tmp_path / "restored"
+    restored.mkdir()
+    assert cache.get(keys[0], str(restored)) is None
+    cached = cache.get(keys[2], str(restored))
+    assert cached.metadata == {"parameters": {"key": keys[2]}}
+    with open(cached.paths["DSC_Curve.csv"]) as f:
+        assert f.read() == "1,2,3\n"
+
+
+def test_disabled(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_entries=0)
+    cache.put("key", [], {})
+    assert cache.get("key", str(tmp_path)) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_discard(tmp_path):
+    work = tmp_path / "work"
+    work.mkdir()
+    (work / "DSC_Curve.csv").write_text("1,2,3\n")
+    cache = ArtifactCache(str(tmp_path / "cache"), max_entries=2)
+    key = ArtifactCache.key({"Input sha256": "0"}, False)
+    cache.put(key, [str(work / "DSC_Curve.csv")], {"parameters": {}})
+
+    cache.discard(key)
+    assert cache.get(key, str(work)) is None
+    # A fresh entry can be stored in its place
+    cache.put(key, [str(work / "DSC_Curve.csv")], {"parameters": {"new": True}})
+    assert cache.get(key, str(work)).metadata == {"parameters": {"new": True}}
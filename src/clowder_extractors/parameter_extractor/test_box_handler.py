@@ -0,0 +1,95 @@
+import json
+import os
+import time
+
+import pytest
+from boxsdk.auth.ccg_auth import CCGAuth
+from boxsdk.auth.oauth2 import TokenResponse
+
+import BoxHandler
+from BoxHandler import CachedCCGAuth
+
+
+class FakeTokenEndpoint:
+    # Replaces the request boxsdk sends for a new token, and counts them
+    def __init__(self, expires_in=3600):
+        self.expires_in = expires_in
+        self.requests = 0
+
+    def __call__(self, auth, data, access_token, expect_refresh_token=True):
+        self.requests += 1
+        response = {"access_token": f"token-{self.requests}"}
+        if self.expires_in is not None:
+            response["expires_in"] = self.expires_in
+        return TokenResponse(response)
+
+
+@pytest.fixture
+def endpoint(monkeypatch):
+    endpoint = FakeTokenEndpoint()
+    monkeypatch.setattr(CCGAuth, "_execute_token_request", endpoint)
+    return endpoint
+
+
+def new_auth(cache_path=None, client_id="client"):
+    return CachedCCGAuth(
+        client_id=client_id,
+        client_secret="secret",
+        enterprise_id="83165",
+        cache_path=cache_path,
+    )
+
+
+def test_token_replaced_before_expiry(endpoint, monkeypatch):
+    monkeypatch.setattr(BoxHandler, "token_refresh_margin", 300)
+    auth = new_auth()
+    assert auth.access_token is None
+
+    token, _ = auth.refresh(None)
+    assert token == "token-1"
+    assert auth._expires_at == pytest.approx(time.time() + 3600, abs=5)
+    # A fresh token is used as is
+    assert auth.access_token == "token-1"
+    assert auth.refresh(None) == ("token-1", None)
+    assert endpoint.requests == 1
+
+    # Within the margin the token counts as expired and is replaced
+    auth._expires_at = time.time() + 299
+    assert auth.access_token is None
+    assert auth.refresh(None)[0] == "token-2"
+    assert endpoint.requests == 2
+
+
+def test_expiry_defaults_to_an_hour(endpoint):
+    endpoint.expires_in = None
+    auth = new_auth()
+    auth.refresh(None)
+    assert auth._expires_at == pytest.approx(time.time() + 3600, abs=5)
+
+
+def test_token_shared_through_cache(endpoint, tmp_path):
+    cache_path = str(tmp_path / "box-token.json")
+    new_auth(cache_path).refresh(None)
+
+    with open(cache_path) as f:
+        cached = json.load(f)
+    assert cached["access_token"] == "token-1"
+    assert cached["client_id"] == "client"
+    assert cached["enterprise_id"] == "83165"
+    assert os.stat(cache_path).st_mode & 0o777 == 0o600
+
+    # A restarted worker uses the cached token without asking Box
+    restarted = new_auth(cache_path)
+    assert restarted.access_token == "token-1"
+    assert restarted.refresh(None) == ("token-1", None)
+    assert endpoint.requests == 1
+
+    # Tokens of another client, expiring tokens and broken files are ignored
+    assert new_auth(cache_path, client_id="other").access_token is None
+    cached["expires_at"] = time.time() + 60
+    with open(cache_path, "w") as f:
+        json.dump(cached, f)
+    assert new_auth(cache_path).access_token is None
+    with open(cache_path, "w") as f:
+        f.write("not json")
+    assert new_auth(cache_path).access_token is None
@@ -0,0 +1,110 @@
+from types import SimpleNamespace
+
+import pyclowder.datasets
+import pytest
+
+import clowder_dataset_helpers
+from clowder_dataset_helpers import (
+    DatasetFileIndex,
+    dataset_has_xls_file,
+    delete_files_from_dataset_by_filename,
+)
+
+
+class FakeDataset:
+    # Stands in for get_file_list and the DELETE call, and counts listings
+    def __init__(self, files):
+        self.files = files
+        self.listings = 0
+        self.deleted = []
+
+    def get_file_list(self, connector, host, key, dataset_id):
+        self.listings += 1
+        if isinstance(self.files, Exception):
+            raise self.files
+        return self.files
+
+    def request(self, connector, method, url, **kwargs):
+        assert method == "DELETE"
+        self.deleted.append(url.split("/")[-1].split("?")[0])
+        return SimpleNamespace(raise_for_status=lambda: None)
+
+
+@pytest.fixture
+def dataset(monkeypatch):
+    dataset = FakeDataset(
+        [
+            {"id": "1", "filename": "DSC_Curve.csv"},
+            {"id": "2", "filename": "DSC_Curve.csv"},
+            {"id": "3", "filename": "export.txt"},
+            "not a file",
+        ]
+    )
+    monkeypatch.setattr(pyclowder.datasets, "get_file_list", dataset.get_file_list)
+    monkeypatch.setattr(clowder_dataset_helpers, "clowder_request", dataset.request)
+    return dataset
+
+
+def new_index():
+    return DatasetFileIndex(None, "http://clowder/", "key", "dataset")
+
+
+def test_lists_once(dataset):
+    index = new_index()
+    assert dataset.listings == 0
+
+    assert index.filenames() == ["DSC_Curve.csv", "DSC_Curve.csv", "export.txt"]
+    assert [f["id"] for f in index.by_name("DSC_Curve.csv")] == ["1", "2"]
+    assert index.by_extension(".TXT") == [{"id": "3", "filename": "export.txt"}]
+    assert index.by_id("3")["filename"] == "export.txt"
+    assert index.by_id("4") is None
+    assert dataset.listings == 1
+
+
+def test_failed_listing_is_tried_again(dataset):
+    files = dataset.files
+    dataset.files = ConnectionError("Clowder is down")
+    index = new_index()
+    with pytest.raises(ConnectionError):
+        index.files
+
+    dataset.files = files
+    assert len(index.files) == 3
+    assert dataset.listings == 2
+
+
+def test_added_and_removed(dataset):
+    index = new_index()
+    # Before the listing there is nothing to update; the listing has the file
+    index.added("9", "/tmp/ignored.csv")
+    assert len(index.files) == 3
+
+    index.added("4", "/tmp/work/DSC_Curve.png")
+    index.removed("1")
+    assert index.by_name("DSC_Curve.png") == [{"id": "4", "filename": "DSC_Curve.png"}]
+    assert [f["id"] for f in index.by_name("DSC_Curve.csv")] == ["2"]
+    assert dataset.listings == 1
+
+
+def test_helpers_share_the_index(dataset):
+    index = new_index()
+
+    assert not dataset_has_xls_file(
+        None, "http://clowder/", "key", "dataset", None, index
+    )
+    assert (
+        delete_files_from_dataset_by_filename(
+            None, "http://clowder/", "key", "dataset", "DSC_Curve.csv", None, index
+        )
+        == 2
+    )
+    assert dataset.deleted == ["1", "2"]
+    assert index.by_name("DSC_Curve.csv") == []
+
+    index.added("5", "/tmp/work/datasheet.xlsx")
+    assert dataset_has_xls_file(None, "http://clowder/", "key", "dataset", None, index)
+    assert dataset.listings == 1
+
+    # Without an index each helper lists the dataset itself
+    dataset_has_xls_file(None, "http://clowder/", "key", "dataset")
+    assert dataset.listings == 2
@@ -0,0 +1,93 @@
+from types import SimpleNamespace
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+from urllib3.response import HTTPResponse
+from urllib3.util.retry import Retry
+
+import clowder_http
+from clowder_http import JitteredRetry, clowder_request, clowder_session
+
+
+class StubAdapter(BaseAdapter):
+    # Answers every request with 200 and remembers how it was sent
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    def send(self, request, **kwargs):
+        self.sent.append(kwargs)
+        response = requests.Response()
+        response.status_code = 200
+        response.request = request
+        response.url = request.url
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def session(monkeypatch):
+    # A fresh shared session, with requests answered by a StubAdapter
+    monkeypatch.setattr(clowder_http, "_session", None)
+    adapter = StubAdapter()
+    clowder_session().mount("http://", adapter)
+    # Keep REQUESTS_CA_BUNDLE and proxies out of the settings that are checked
+    clowder_session().trust_env = False
+    return adapter
+
+
+def failed(retry: JitteredRetry, times: int) -> JitteredRetry:
+    for _ in range(times):
+        retry = retry.increment(
+            method="GET", url="/api/files", response=HTTPResponse(status=503)
+        )
+    return retry
+
+
+def test_backoff_is_jittered_within_bounds(monkeypatch):
+    retry = failed(JitteredRetry(total=5, backoff_factor=0.5), 3)
+    # Exponential backoff after three consecutive failures: 0.5 * 2 ** 2
+    assert Retry.get_backoff_time(retry) == 2.0
+
+    bounds = []
+    monkeypatch.setattr(
+        clowder_http.random, "uniform", lambda a, b: bounds.append((a, b)) or b
+    )
+    assert retry.get_backoff_time() == 2.0
+    assert bounds == [(0, 2.0)]
+
+    monkeypatch.undo()
+    backoffs = [retry.get_backoff_time() for _ in range(200)]
+    assert all(0 <= backoff <= 2.0 for backoff in backoffs)
+    assert len(set(backoffs)) > 1
+
+
+def test_session_is_shared(monkeypatch):
+    monkeypatch.setattr(clowder_http, "_session", None)
+    session = clowder_session()
+    assert clowder_session() is session
+
+    for prefix in ("http://", "https://"):
+        retry = session.get_adapter(prefix + "clowder").max_retries
+        assert isinstance(retry, JitteredRetry)
+        assert retry.total == clowder_http.http_retries
+        assert 429 in retry.status_forcelist
+        # POST isn't idempotent, so it is never retried
+        assert "POST" not in retry.allowed_methods
+
+
+def test_request_passes_connector_settings(session):
+    connector = SimpleNamespace(ssl_verify=False)
+    response = clowder_request(connector, "GET", "http://clowder/api/files/1")
+
+    assert response.status_code == 200
+    assert session.sent[-1]["verify"] is False
+    assert session.sent[-1]["timeout"] == clowder_http.http_timeout
+
+    # Explicit arguments win, and without a connector certificates are verified
+    clowder_request(None, "DELETE", "http://clowder/api/files/1", timeout=5)
+    assert session.sent[-1]["verify"] is True
+    assert session.sent[-1]["timeout"] == 5
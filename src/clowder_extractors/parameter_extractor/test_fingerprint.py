@@ -0,0 +1,203 @@
+import hashlib
+import importlib.util
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+import pyclowder.datasets
+import pyclowder.files
+import pytest
+
+import fingerprint
+from clowder_dataset_helpers import DatasetFileIndex
+from fingerprint import (
+    DATASHEET_KEY,
+    FINGERPRINT_KEY,
+    already_extracted,
+    input_fingerprint,
+    is_forced,
+)
+
+trigger_script = (
+    Path(__file__).resolve().parents[3]
+    / "scripts"
+    / "trigger_space_file_extractions.py"
+)
+
+
+class FakeClowder:
+    # Answers the Clowder calls already_extracted makes and counts them
+    def __init__(self, files, metadata, thumbnail="thumb", previews=("preview",)):
+        self.files = files
+        self.metadata = metadata
+        self.thumbnail = thumbnail
+        self.previews = list(previews)
+        self.calls = []
+
+    def install(self, monkeypatch):
+        monkeypatch.setattr(pyclowder.datasets, "get_file_list", self.get_file_list)
+        monkeypatch.setattr(
+            pyclowder.datasets, "download_metadata", self.download_metadata
+        )
+        monkeypatch.setattr(pyclowder.files, "download_info", self.download_info)
+        monkeypatch.setattr(fingerprint, "clowder_request", self.request)
+
+    def get_file_list(self, connector, host, key, dataset_id):
+        self.calls.append("get_file_list")
+        return self.files
+
+    def download_metadata(self, connector, host, key, dataset_id):
+        self.calls.append("download_metadata")
+        return self.metadata
+
+    def download_info(self, connector, host, key, file_id):
+        self.calls.append("download_info")
+        return {"id": file_id, "thumbnail": self.thumbnail}
+
+    def request(self, connector, method, url, **kwargs):
+        self.calls.append("listpreviews")
+        return SimpleNamespace(
+            raise_for_status=lambda: None, json=lambda: self.previews
+        )
+
+
+@pytest.fixture
+def extracted():
+    return {"Input sha256": "0" * 64, "Extractor version": "1.0"}
+
+
+def check(extracted):
+    connector = SimpleNamespace(ssl_verify=True)
+    index = DatasetFileIndex(connector, "http://clowder/", "key", "dataset")
+    return already_extracted(
+        connector, "http://clowder/", "key", "dataset", extracted, index
+    )
+
+
+def test_input_fingerprint(tmp_path):
+    path = tmp_path / "export.txt"
+    path.write_bytes(b"[Header]\n")
+
+    assert input_fingerprint(str(path), "1.0", "v2") == {
+        "Input sha256": hashlib.sha256(b"[Header]\n").hexdigest(),
+        "Extractor version": "1.0",
+        "Chemistry database version": "v2",
+    }
+    assert input_fingerprint(str(path), "1.1", "v2") != input_fingerprint(
+        str(path), "1.0", "v2"
+    )
+
+
+@pytest.mark.parametrize(
+    "message, forced",
+    [
+        ({"parameters": {"force": True}}, True),
+        ({"parameters": {"force": "true"}}, True),
+        ({"parameters": json.dumps({"force": "yes"})}, True),
+        ({"parameters": {"force": False}}, False),
+        ({"parameters": "not json"}, False),
+        ({}, False),
+        (None, False),
+    ],
+)
+def test_is_forced(monkeypatch, message, forced):
+    monkeypatch.setattr(fingerprint, "force_reextraction", False)
+    assert is_forced(message) == forced
+
+
+def test_is_forced_by_environment(monkeypatch):
+    monkeypatch.setattr(fingerprint, "force_reextraction", True)
+    assert is_forced({})
+
+
+def test_matching_fingerprint(monkeypatch, extracted):
+    clowder = FakeClowder(
+        [{"id": "1", "filename": "DSC_Curve.csv"}, {"id": "2", "filename": "a.xlsx"}],
+        [{"content": {FINGERPRINT_KEY: extracted, DATASHEET_KEY: "a.xlsx"}}],
+    )
+    clowder.install(monkeypatch)
+    assert check(extracted)
+    assert clowder.calls == [
+        "get_file_list",
+        "download_metadata",
+        "download_info",
+        "listpreviews",
+    ]
+
+
+def test_mismatched_fingerprint(monkeypatch, extracted):
+    clowder = FakeClowder(
+        [{"id": "1", "filename": "DSC_Curve.csv"}],
+        [{"content": {FINGERPRINT_KEY: dict(extracted, **{"Input sha256": "1"})}}],
+    )
+    clowder.install(monkeypatch)
+    assert not check(extracted)
+    # The previews are only looked up once the fingerprint matches
+    assert clowder.calls == ["get_file_list", "download_metadata"]
+
+
+def test_missing_fingerprint(monkeypatch, extracted):
+    clowder = FakeClowder(
+        [{"id": "1", "filename": "DSC_Curve.csv"}], [{"content": {"Analysis": {}}}]
+    )
+    clowder.install(monkeypatch)
+    assert not check(extracted)
+
+
+def test_missing_outputs(monkeypatch, extracted):
+    metadata = [{"content": {FINGERPRINT_KEY: extracted, DATASHEET_KEY: "a.xlsx"}}]
+
+    # No DSC_Curve.csv: the metadata isn't even fetched
+    clowder = FakeClowder([], metadata)
+    clowder.install(monkeypatch)
+    assert not check(extracted)
+    assert clowder.calls == ["get_file_list"]
+
+    # The generated datasheet is gone
+    clowder = FakeClowder([{"id": "1", "filename": "DSC_Curve.csv"}], metadata)
+    clowder.install(monkeypatch)
+    assert not check(extracted)
+
+    # No thumbnail, or no preview
+    files = [
+        {"id": "1", "filename": "DSC_Curve.csv"},
+        {"id": "2", "filename": "a.xlsx"},
+    ]
+    for clowder in (
+        FakeClowder(files, metadata, thumbnail=None),
+        FakeClowder(files, metadata, previews=()),
+    ):
+        clowder.install(monkeypatch)
+        assert not check(extracted)
+
+
+def test_errors_extract_again(monkeypatch, extracted):
+    clowder = FakeClowder([{"id": "1", "filename": "DSC_Curve.csv"}], [])
+
+    def unreachable(*args):
+        raise ConnectionError("Clowder is down")
+
+    clowder.install(monkeypatch)
+    monkeypatch.setattr(pyclowder.datasets, "download_metadata", unreachable)
+    assert not check(extracted)
+
+
+def test_trigger_script_force():
+    spec = importlib.util.spec_from_file_location("trigger", trigger_script)
+    trigger = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(trigger)
+
+    arguments = ["--host", "h", "--api-key", "k", "--space-id", "s"]
+    arguments += ["--extractor", "e"]
+    parser = trigger.build_parser()
+    assert not parser.parse_args(arguments).force
+    assert parser.parse_args(arguments + ["--force"]).force
+
+    posted = []
+    client = SimpleNamespace(post=lambda path, payload: posted.append(payload))
+    trigger.submit_file_extraction_with_status(client, "1", "e")
+    trigger.submit_file_extraction_with_status(client, "1", "e", force=True)
+    assert posted == [
+        {"extractor": "e"},
+        {"extractor": "e", "parameters": {"force": True}},
+    ]
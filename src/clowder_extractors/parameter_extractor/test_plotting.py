@@ -0,0 +1,25 @@
+import numpy as np
+
+from plotting import decimate
+
+
+def test_decimate_keeps_extremes():
+    x = np.linspace(0.0, 300.0, 100_000)
+    y = np.sin(x / 10.0)
+    y[12_345] = 5.0
+    y[67_890] = -5.0
+    y[50_000] = np.nan
+
+    x_small, y_small = decimate(x, y, 100)
+
+    assert len(y_small) <= 400
+    assert np.all(np.diff(x_small) > 0)
+    assert x_small[0] == x[0] and x_small[-1] == x[-1]
+    assert np.nanmax(y_small) == 5.0 and np.nanmin(y_small) == -5.0
+    assert np.isnan(y_small).sum() == 1
+
+
+def test_decimate_short_curve():
+    x = np.arange(10.0)
+    x_small, y_small = decimate(x, x * 2, 100)
+    assert x_small is x
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+from boxsdk.exception import BoxAPIException
+
+from BoxHandler import BoxFileEntry, BoxHandler, FolderIndex
+from template_store import TemplateStore
+
+CONTENT = b"template workbook"
+
+
+class FakeBoxHandler(BoxHandler):
+    # Serves one file from a folder listing, without a Box connection
+    def __init__(self, sha1):
+        self.sha1 = sha1
+        self.file_id = "1"
+        self.downloads = 0
+        self.listings = 0
+        self.client = SimpleNamespace(file=self.file)
+        self._folder_indexes = {}
+        self._folder_index_lock = threading.Lock()
+
+    def _load_folder_index(self, shared_link):
+        self.listings += 1
+        files = {"Template.xlsx": BoxFileEntry(self.file_id, self.sha1, None)}
+        return FolderIndex("folder", files, time.monotonic())
+
+    def file(self, file_id):
+        if file_id != self.file_id:
+            raise BoxAPIException(404, message="Not Found")
+        return self
+
+    def download_to(self, writer):
+        self.downloads += 1
+        writer.write(CONTENT)
+
+
+def test_downloads_each_version_once(tmp_path):
+    store = TemplateStore(str(tmp_path / "store"))
+    box = FakeBoxHandler(hashlib.sha1(CONTENT).hexdigest())
+
+    for name in ("first.xlsx", "second.xlsx"):
+        destination = tmp_path / name
+        store.fetch(box, "link", "Template.xlsx", str(destination))
+        assert destination.read_bytes() == CONTENT
+    assert box.downloads == 1
+
+    # A new version in Box is downloaded again once the listing is fetched again
+    box.sha1 = "0" * 40
+    box.invalidate_shared_link("link")
+    store.fetch(box, "link", "Template.xlsx", str(tmp_path / "third.xlsx"))
+    assert box.downloads == 2
+
+
+def test_stale_sha1_is_listed_again(tmp_path):
+    store_dir = tmp_path / "store"
+    store = TemplateStore(str(store_dir))
+    box = FakeBoxHandler("1" * 40)
+    store.fetch(box, "link", "Template.xlsx", str(tmp_path / "first.xlsx"))
+
+    # The listing is fetched again to learn the real sha1, so the next fetch
+    # uses the stored copy
+    box.sha1 = hashlib.sha1(CONTENT).hexdigest()
+    store.fetch(box, "link", "Template.xlsx", str(tmp_path / "second.xlsx"))
+    assert box.downloads == 1
+    assert box.listings == 2
+
+
+def test_older_versions_are_removed(tmp_path):
+    store_dir = tmp_path / "store"
+    store_dir.mkdir()
+    (store_dir / f"{'0' * 40}_Template.xlsx").write_bytes(b"old version")
+    (store_dir / f"{'0' * 40}_Other_Template.xlsx").write_bytes(b"other template")
+    store = TemplateStore(str(store_dir))
+    box = FakeBoxHandler(hashlib.sha1(CONTENT).hexdigest())
+
+    store.fetch(box, "link", "Template.xlsx", str(tmp_path / "datasheet.xlsx"))
+
+    assert sorted(p.name for p in store_dir.iterdir()) == [
+        f"{'0' * 40}_Other_Template.xlsx",
+        f"{box.sha1}_Template.xlsx",
+    ]
+
+
+def test_replaced_file_is_listed_again(tmp_path):
+    store = TemplateStore(str(tmp_path / "store"))
+    box = FakeBoxHandler(hashlib.sha1(CONTENT).hexdigest())
+    box.find_file_in_shared_link("link", "Template.xlsx")
+
+    # Deleted and uploaded again under the same name, with a new ID
+    box.file_id = "2"
+    destination = tmp_path / "datasheet.xlsx"
+    store.fetch(box, "link", "Template.xlsx", str(destination))
+
+    assert destination.read_bytes() == CONTENT
+    assert box.listings == 2
+
+
+def test_newer_version_stored_concurrently(tmp_path, monkeypatch):
+    store_dir = tmp_path / "store"
+    store = TemplateStore(str(store_dir))
+    box = FakeBoxHandler(hashlib.sha1(CONTENT).hexdigest())
+
+    def stored_newer_version(file_name, current):
+        # Another worker stores a newer version and removes this one
+        os.remove(current)
+
+    monkeypatch.setattr(store, "_remove_older_versions", stored_newer_version)
+    destination = tmp_path / "datasheet.xlsx"
+    store.fetch(box, "link", "Template.xlsx", str(destination))
+
+    assert destination.read_bytes() == CONTENT
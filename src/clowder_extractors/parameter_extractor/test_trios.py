@@ -0,0 +1,98 @@
+import io
+
+import pytest
+from trios import (
+    CurveCSVWriter,
+    DataPoint,
+    KeyValue,
+    ParameterCollector,
+    SectionStart,
+    TriosLayoutError,
+    TriosSectionIndex,
+    Variables,
+    dispatch,
+    iter_data_blocks,
+    iter_trios_events,
+)
+
+trios_export = "\n".join(
+    [
+        "[Header]",
+        "Project",
+        "[Analysis]",
+        "Model\tPeak integration",
+        "Baseline cursor x\t20.1 °C",
+        "Baseline cursor x\t230.2 °C",
+        "[Step]",
+        "Number of points\t3",
+        "Variables\tTime\tTemperature\tHeat Flow",
+        "Data point\t0.0\t25.0\t0.5",
+        "Data point\t0.1\t26.0\t",
+        "Variables\tTime\tTemperature\tHeat Flow",
+        "Data point\t0.2\t27.0\t1.5",
+        "",
+    ]
+)
+
+
+def test_events():
+    events = list(iter_trios_events(io.StringIO(trios_export)))
+    assert events[:3] == [
+        SectionStart("Header"),
+        KeyValue("Header", "Project", "Project"),
+        SectionStart("Analysis"),
+    ]
+    assert Variables(["Time", "Temperature", "Heat Flow"]) in events
+    assert events[-1] == DataPoint(["0.2", "27.0", "1.5"])
+
+
+def test_consumers():
+    collector = ParameterCollector()
+    dsc_file = io.StringIO()
+    dispatch(
+        iter_trios_events(io.StringIO(trios_export)),
+        collector,
+        CurveCSVWriter(dsc_file),
+    )
+
+    assert collector.parameters["Analysis"]["Baseline cursor x"] == [
+        "20.1 °C",
+        "230.2 °C",
+    ]
+    assert collector.parameters["Step"] == {}
+    assert dsc_file.getvalue().splitlines() == [
+        "Time,Temperature,Heat Flow",
+        "0.0,25.0,0.5",
+        "0.1,26.0,",
+        "0.2,27.0,1.5",
+    ]
+
+
+def test_section_index(tmp_path):
+    path = tmp_path / "export.txt"
+    path.write_bytes(
+        (trios_export + "[Results]\nPeak\t1\n").replace("\n", "\r\n").encode()
+    )
+    sections = TriosSectionIndex(str(path), encoding="utf-8")
+
+    assert list(sections) == ["Header", "Analysis", "Step", "Results"]
+    assert sections["Analysis"]["Baseline cursor x"] == ["20.1 °C", "230.2 °C"]
+    assert sections["Step"] == {}
+    assert sections["Results"] == {"Peak": "1"}
+
+    data_block = sections.data_block()
+    assert data_block.columns == ["Time", "Temperature", "Heat Flow"]
+    with open(path, "rb") as stream:
+        stream.seek(data_block.start)
+        blocks = iter_data_blocks(stream, data_block.end, "utf-8", block_size=16)
+        assert "".join(blocks).splitlines() == [
+            "0.0,25.0,0.5",
+            "0.1,26.0,",
+            "0.2,27.0,1.5",
+        ]
+
+
+def test_bulk_section_after_data():
+    stream = io.BytesIO(b"Data point\t0.0\t25.0\t0.5\n[Results]\nPeak\t1\n")
+    with pytest.raises(TriosLayoutError):
+        list(iter_data_blocks(stream, encoding="utf-8"))
@@ -0,0 +1,43 @@
+import threading
+
+import pytest
+from upload_pipeline import StageSkipped, UploadPipeline, UploadPipelineError
+
+
+def test_dependencies_and_concurrency():
+    # Each of the first two stages waits for the other to start
+    both_running = threading.Barrier(2, timeout=5)
+
+    def upload(result):
+        both_running.wait()
+        return result
+
+    pipeline = UploadPipeline(max_workers=2)
+    pipeline.add("csv", lambda: upload("file-id"))
+    pipeline.add("metadata", lambda: upload("ok"))
+    pipeline.add("preview", lambda file_id: f"preview of {file_id}", ["csv"])
+
+    assert pipeline.run() == {
+        "csv": "file-id",
+        "metadata": "ok",
+        "preview": "preview of file-id",
+    }
+
+
+def test_failures_are_reported_per_stage():
+    def fail():
+        raise IOError("upload refused")
+
+    pipeline = UploadPipeline()
+    pipeline.add("csv", fail)
+    pipeline.add("preview", lambda file_id: file_id, ["csv"])
+    pipeline.add("metadata", fail, critical=False)
+    pipeline.add("datasheet", lambda: "ok")
+
+    with pytest.raises(UploadPipelineError) as e:
+        pipeline.run()
+
+    assert set(e.value.failures) == {"csv", "preview"}
+    assert isinstance(pipeline.failures["preview"], StageSkipped)
+    assert "metadata" in pipeline.failures
+    assert pipeline.results == {"datasheet": "ok"}
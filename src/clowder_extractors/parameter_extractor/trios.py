@@ -0,0 +1,305 @@
+"""
+Streaming tokenizer for TA Instruments TRIOS text exports.
+
+An export is a series of [Section] blocks. Header sections hold tab separated
+key/value lines, and the Step section holds the measured curve as Variables and
+Data point lines. iter_trios_events() turns the file into a stream of events
+with constant memory, and any number of consumers can be attached to one pass
+over the file with dispatch().
+
+The data points usually make up almost all of the file, so large exports are
+read with TriosSectionIndex and iter_data_blocks() instead: the header is
+located with a memory mapped TriosSectionIndex and parsed lazily, and the data
+block is converted to CSV a block at a time with bytes operations.
+"""
+
+import csv
+import locale
+import mmap
+import os
+import re
+from collections.abc import Mapping
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    TextIO,
+    Tuple,
+    Union,
+)
+
+section_re = re.compile(r"\[(.*)]$")
+
+# The section that holds the curve data points
+DATA_SECTION = "Step"
+
+# Line type prefix of the data point lines
+DATA_POINT = b"Data point\t"
+
+# Bytes of the data section read at a time by iter_data_blocks()
+DATA_BLOCK_BYTES = 16 * 1024 * 1024
+
+
+class TriosLayoutError(Exception):
+    """
+    The data block holds something the bulk parser can't handle, such as a
+    section following the data points. Fall back to iter_trios_events().
+    """
+
+
+class SectionStart(NamedTuple):
+    name: str
+
+
+class KeyValue(NamedTuple):
+    section: str
+    key: str
+    value: str
+
+
+class Variables(NamedTuple):
+    # Column names of the data points that follow
+    columns: List[str]
+
+
+class DataPoint(NamedTuple):
+    # Raw text values, one per column
+    values: List[str]
+
+
+TriosEvent = Union[SectionStart, KeyValue, Variables, DataPoint]
+
+
+def iter_trios_events(lines: Iterable[str]) -> Iterator[TriosEvent]:
+    section = None
+    for line in lines:
+        m = section_re.match(line)
+        if m:
+            section = m.group(1)
+            yield SectionStart(section)
+            continue
+
+        line_values = line.strip("\n").split("\t")
+        if section != DATA_SECTION:
+            if len(line_values) == 2:
+                yield KeyValue(section, line_values[0], line_values[1])
+            # Special case for the Project line
+            elif len(line_values) == 1 and line_values[0] == "Project":
+                yield KeyValue(section, "Project", "Project")
+        else:
+            # The first column contains the line type
+            line_type = line_values[0]
+            if line_type == "Variables":
+                yield Variables(line_values[1:])
+            elif line_type == "Data point":
+                yield DataPoint(line_values[1:])
+
+
+def iter_data_blocks(
+    stream: BinaryIO,
+    end: Optional[int] = None,
+    encoding: Optional[str] = None,
+    block_size: int = DATA_BLOCK_BYTES,
+) -> Iterator[str]:
+    """
+    Read the data section from the current position up to end (or the end of
+    the file) in blocks of whole lines, yielding the data points of each block
+    as CSV text. The line type column is dropped and other lines, such as a
+    repeated Variables line, are left out.
+    """
+    if encoding is None:
+        encoding = locale.getpreferredencoding(False)
+
+    while True:
+        size = block_size if end is None else min(block_size, end - stream.tell())
+        block = stream.read(size) if size > 0 else b""
+        if not block:
+            return
+        # Finish the last line. end is always at the start of a line
+        if end is None or stream.tell() < end:
+            block += stream.readline()
+        block = block.replace(b"\r\n", b"\n")
+        if not block.endswith(b"\n"):
+            block += b"\n"
+
+        if block.startswith(b"[") or b"\n[" in block:
+            raise TriosLayoutError("Found a section after the data points")
+        if b"," in block or b'"' in block:
+            raise TriosLayoutError("Data points need quoting to be written as CSV")
+
+        lines = block.count(b"\n")
+        data_points = block.count(b"\n" + DATA_POINT) + block.startswith(DATA_POINT)
+        if data_points == lines:
+            block = (b"\n" + block).replace(b"\n" + DATA_POINT, b"\n")[1:]
+        else:
+            block = b"".join(
+                line[len(DATA_POINT) :] + b"\n"
+                for line in block.split(b"\n")
+                if line.startswith(DATA_POINT)
+            )
+
+        if block:
+            yield block.replace(b"\t", b",").replace(b"\n", b"\r\n").decode(encoding)
+
+
+def dispatch(events: Iterable[TriosEvent], *consumers: Callable[[TriosEvent], None]):
+    """
+    Feed every event to each consumer in turn
+    """
+    for event in events:
+        for consumer in consumers:
+            consumer(event)
+
+
+class ParameterCollector:
+    """
+    Folds key/value events into {section: {key: value}}. A key that appears
+    more than once in a section is collected into a list.
+    """
+
+    def __init__(self):
+        self.parameters = {}
+
+    def __call__(self, event: TriosEvent):
+        if isinstance(event, SectionStart):
+            self.parameters[event.name] = {}
+        elif isinstance(event, KeyValue):
+            section = self.parameters.setdefault(event.section, {})
+            if event.key not in section:
+                section[event.key] = event.value
+            else:
+                section[event.key] = [section[event.key]] + [event.value]
+
+
+class CurveCSVWriter:
+    """
+    Writes the curve to a CSV file. Only the first Variables line is used as
+    the header; TRIOS sometimes repeats it part way through the data.
+    """
+
+    def __init__(self, sink: TextIO):
+        self.sink = sink
+        self.writer = csv.writer(sink)
+        self.header_written = False
+
+    def __call__(self, event: TriosEvent):
+        if isinstance(event, Variables) and not self.header_written:
+            self.writer.writerow(event.columns)
+            self.header_written = True
+        elif isinstance(event, DataPoint):
+            self.writer.writerow(event.values)
+
+    def write_block(self, block: str):
+        # A block of CSV text from iter_data_blocks()
+        self.sink.write(block)
+
+
+class DataBlock(NamedTuple):
+    # Byte range of the data points and the column names from the Variables line
+    start: int
+    end: int
+    columns: List[str]
+
+
+class TriosSectionIndex(Mapping):
+    """
+    Read only view of a TRIOS export as {section: {key: value}}.
+
+    The file is memory mapped and scanned once for [Section] lines, recording
+    the byte range of each section. A header section is only read and parsed,
+    the same way as ParameterCollector does, the first time it is looked up, so
+    the data block never passes through Python. Duplicate sections follow the
+    streaming parser: the last one wins. The data section maps to {}; use
+    data_block() to find the data points.
+    """
+
+    def __init__(self, path: str, encoding: Optional[str] = None):
+        self.path = path
+        self.encoding = encoding or locale.getpreferredencoding(False)
+        self._ranges: Dict[str, Tuple[int, int]] = {}
+        self._sections: Dict[str, dict] = {}
+        self._data_block = None
+        self._data_sections = 0
+
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    self._scan(buffer)
+
+    def _scan(self, buffer: mmap.mmap):
+        name = None
+        line_start = 0 if buffer[:1] == b"[" else next_bracket_line(buffer, 0)
+        while line_start >= 0:
+            line_end = buffer.find(b"\n", line_start)
+            if line_end < 0:
+                line_end = len(buffer)
+            line = buffer[line_start:line_end].rstrip(b"\r").decode(self.encoding)
+            m = section_re.match(line)
+            if m:
+                if name is not None:
+                    self._ranges[name] = (self._ranges[name][0], line_start)
+                name = m.group(1)
+                self._ranges[name] = (min(line_end + 1, len(buffer)), len(buffer))
+                if name == DATA_SECTION:
+                    self._data_sections += 1
+            line_start = next_bracket_line(buffer, line_end)
+
+        if DATA_SECTION in self._ranges:
+            self._data_block = self._find_variables(buffer, *self._ranges[DATA_SECTION])
+
+    def _find_variables(self, buffer: mmap.mmap, start: int, end: int):
+        # The data points start after the first Variables line
+        line_start = start
+        while 0 <= line_start < end:
+            line_end = buffer.find(b"\n", line_start, end)
+            if line_end < 0:
+                line_end = end
+            line = buffer[line_start:line_end].rstrip(b"\r").decode(self.encoding)
+            line_values = line.split("\t")
+            if line_values[0] == "Variables":
+                return DataBlock(min(line_end + 1, end), end, line_values[1:])
+            line_start = line_end + 1
+        return None
+
+    def data_block(self) -> Optional[DataBlock]:
+        """
+        Where the data points are, or None if there are none. Raises
+        TriosLayoutError if the data is split over several sections.
+        """
+        if self._data_sections > 1:
+            raise TriosLayoutError(
+                f"Found {self._data_sections} {DATA_SECTION} sections"
+            )
+        return self._data_block
+
+    def __getitem__(self, name: str) -> dict:
+        if name not in self._sections:
+            start, end = self._ranges[name]
+            if name == DATA_SECTION:
+                self._sections[name] = {}
+            else:
+                with open(self.path, "rb") as f:
+                    f.seek(start)
+                    text = f.read(end - start).decode(self.encoding)
+                collector = ParameterCollector()
+                lines = [f"[{name}]"] + text.replace("\r\n", "\n").split("\n")
+                dispatch(iter_trios_events(lines), collector)
+                self._sections[name] = collector.parameters[name]
+        return self._sections[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._ranges)
+
+    def __len__(self) -> int:
+        return len(self._ranges)
+
+
+def next_bracket_line(buffer: mmap.mmap, start: int) -> int:
+    # Offset of the next line starting with "[", or -1 if there are none
+    found = buffer.find(b"\n[", start)
+    return found + 1 if found >= 0 else -1
@@ -0,0 +1,123 @@
+"""
+Runs an extractor's output uploads as a small dependency graph.
+
+Each stage names the stages it depends on and is called with their results, in
+that order, once they have all finished. Independent stages run concurrently
+on a bounded thread pool, so for example the dataset metadata doesn't wait
+behind the preview images.
+"""
+
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+# Number of uploads to run at once
+upload_concurrency = int(os.getenv("UPLOAD_CONCURRENCY", 4))
+
+
+class Stage(NamedTuple):
+    name: str
+    function: Callable[..., Any]
+    depends_on: Sequence[str]
+    critical: bool
+
+
+class UploadPipelineError(Exception):
+    def __init__(self, failures: Dict[str, BaseException]):
+        self.failures = failures
+        super().__init__(
+            "Upload stages failed: "
+            + "; ".join(f"{name}: {error}" for name, error in failures.items())
+        )
+
+
+class StageSkipped(Exception):
+    """
+    A stage didn't run because a stage it depends on failed
+    """
+
+
+class UploadPipeline:
+    def __init__(
+        self,
+        logger: Optional[logging.Logger] = None,
+        max_workers: Optional[int] = None,
+    ):
+        self.logger = logger or logging.getLogger(__name__)
+        self.max_workers = max_workers or upload_concurrency
+        self.stages: Dict[str, Stage] = {}
+        self.results: Dict[str, Any] = {}
+        self.failures: Dict[str, BaseException] = {}
+
+    def add(
+        self,
+        name: str,
+        function: Callable[..., Any],
+        depends_on: Sequence[str] = (),
+        critical: bool = True,
+    ):
+        """
+        Add a stage. function is called with the results of depends_on. A
+        failed critical stage makes run() raise; other failures are only logged.
+        """
+        if name in self.stages:
+            raise ValueError(f"Duplicate upload stage {name}")
+        for dependency in depends_on:
+            if dependency not in self.stages:
+                raise ValueError(f"Upload stage {name} depends on unknown {dependency}")
+        self.stages[name] = Stage(name, function, tuple(depends_on), critical)
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Run every stage and return their results by name. Raises
+        UploadPipelineError, after all other stages have finished, if a
+        critical stage failed or was skipped.
+        """
+        pending: List[Stage] = list(self.stages.values())
+        running: Dict[Future, Stage] = {}
+
+        with ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="upload"
+        ) as executor:
+            while pending or running:
+                for stage in list(pending):
+                    failed = [d for d in stage.depends_on if d in self.failures]
+                    if failed:
+                        pending.remove(stage)
+                        self._failed(
+                            stage, StageSkipped(f"skipped, {', '.join(failed)} failed")
+                        )
+                    elif all(d in self.results for d in stage.depends_on):
+                        pending.remove(stage)
+                        args = [self.results[d] for d in stage.depends_on]
+                        running[executor.submit(stage.function, *args)] = stage
+
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    try:
+                        self.results[stage.name] = future.result()
+                    except Exception as e:
+                        self._failed(stage, e)
+
+        critical = {
+            name: error
+            for name, error in self.failures.items()
+            if self.stages[name].critical
+        }
+        if critical:
+            raise UploadPipelineError(critical)
+        return self.results
+
+    def _failed(self, stage: Stage, error: BaseException):
+        self.failures[stage.name] = error
+        if isinstance(error, StageSkipped):
+            self.logger.error("Upload stage %s %s", stage.name, error)
+        else:
+            self.logger.error(
+                "Upload stage %s failed: %s", stage.name, error, exc_info=error
+            )
@@ -0,0 +1,119 @@
+"""
+Warm-up of an extractor's slow first-use paths before it takes messages.
+
+Without it the first message after a container starts pays for importing
+pandas and matplotlib, building matplotlib's font cache, loading the chemistry
+database and authenticating to Box all at once. Each extractor's main() passes
+its steps to warm_up() before extractor.start(), and the time each step took is
+logged.
+
+Configured through environment variables:
+    EXTRACTOR_WARMUP  - blocking: run the steps before taking messages
+                        background: run them in a thread while taking messages
+                        off: skip them
+                        (default blocking)
+"""
+
+import importlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+WARMUP_MODES = ("blocking", "background", "off")
+
+Step = Tuple[str, Callable[[], object]]
+
+
+def import_modules(*names: str) -> Step:
+    return "imports", lambda: [importlib.import_module(name) for name in names]
+
+
+def render_plot() -> Step:
+    # Builds the font cache and the figure of a render thread
+    def render():
+        import numpy as np
+
+        from clowder_extractors.parameter_extractor.plotting import (
+            plot_heat_flow,
+            render_executor,
+        )
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            curve = np.linspace(0.0, 1.0, 16)
+            render_executor.submit(plot_heat_flow, curve, curve, tmpdirname).result()
+
+    return "plot", render
+
+
+def load_chemdb() -> Step:
+    def load():
+        from clowder_extractors.experiment_from_excel.chemistry import shared_chemdb
+
+        return shared_chemdb.get().version
+
+    return "chemistry database", load
+
+
+def connect_box(shared_link: str) -> Step:
+    # Authenticates the shared Box client and lists the datasheet folder
+    def connect():
+        from clowder_extractors.parameter_extractor.BoxHandler import (
+            get_box_handler,
+        )
+
+        get_box_handler().prefetch_shared_link(shared_link)
+
+    return "box", connect
+
+
+def run_steps(steps: Sequence[Step]) -> Dict[str, float]:
+    """
+    Run each step and return the seconds each took. A failed step is logged and
+    left for the first message to retry.
+    """
+    timings = {}
+    started = time.perf_counter()
+    for name, step in steps:
+        step_started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            logger.warning("Warm-up step %s failed: %s", name, e)
+        timings[name] = time.perf_counter() - step_started
+
+    logger.info(
+        "Warm-up finished in %.2f s (%s)",
+        time.perf_counter() - started,
+        ", ".join(f"{name} {seconds:.2f} s" for name, seconds in timings.items()),
+    )
+    return timings
+
+
+def warm_up(
+    steps: Sequence[Step], mode: Optional[str] = None
+) -> Optional[threading.Thread]:
+    """
+    Run the steps as EXTRACTOR_WARMUP (or mode) says. Returns the thread
+    running them in background mode.
+    """
+    mode = (mode or os.getenv("EXTRACTOR_WARMUP", "blocking")).lower()
+    if mode not in WARMUP_MODES:
+        logger.warning("Unknown EXTRACTOR_WARMUP %s; warming up blocking", mode)
+        mode = "blocking"
+
+    if mode == "off":
+        return None
+    if mode == "background":
+        thread = threading.Thread(
+            target=run_steps, args=(steps,), name="warmup", daemon=True
+        )
+        thread.start()
+        return thread
+
+    run_steps(steps)
+    return None